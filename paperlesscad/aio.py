@@ -0,0 +1,218 @@
+"""Asyncio front end for dfm_check, with checks run in worker processes.
+
+For asyncio programs, such as upload services, that must not block their
+event loop on a check.  Needs Python 3.7 or later:
+
+    async with AsyncChecker(workers=4) as checker:
+        result, error = await checker.check('/tmp/upload.step', timeout=60)
+
+Unlike with multiprocessing.Pool, each worker is a process of its own, so one
+that is stuck on a check can be killed and replaced without disturbing the
+others.
+
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from multiprocessing import cpu_count
+
+from paperlesscad.workers import serve
+
+
+class _Worker(object):
+    """A worker process, and the queue of messages received from it.
+
+    A thread waits for messages from the process and puts them on the queue,
+    so the event loop never waits on the pipe itself.  When the process
+    exits, for whatever reason, the thread puts ('exit', None) on the queue.
+
+    """
+
+    def __init__(self, context, cache, loop):
+        self.loop = loop
+        self.messages = asyncio.Queue()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn, cache))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.busy = False
+        self.thread = threading.Thread(target=self._receive)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _receive(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._post(message)
+        self.process.join()
+        self.conn.close()
+        self._post(('exit', None))
+
+    def _post(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self.messages.put_nowait, message)
+        except RuntimeError:
+            # The event loop has been closed, so nobody is listening.
+            pass
+
+    def stop(self):
+        "Ask the process to exit once it has finished its current job."
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+
+    def kill(self):
+        "End the process straight away."
+        self.process.kill()
+
+
+class AsyncChecker(object):
+    """Runs dfm_check on a fixed number of worker processes.
+
+    At most workers checks run at once, and at most max_queued more wait for
+    a worker; any more are refused with asyncio.QueueFull so that callers can
+    back off.  Workers are replaced after max_jobs_per_worker jobs, to contain
+    memory growth within OCC.  A ResultCache may be given as cache, which all
+    workers will share.  stats counts the checks handled.
+
+    Workers are started the first time they are needed, and are stopped by
+    close, or on leaving an async with block.
+
+    NOTE Workers are started with the "spawn" method, which imports the
+    program's main module again in each one, so that must not start anything
+    unless run as __main__.
+
+    """
+
+    def __init__(self, workers=None, max_queued=64, max_jobs_per_worker=100,
+                 cache=None):
+        self.workers = workers or cpu_count()
+        self.max_queued = max_queued
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.cache = cache
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0,
+                      'timed_out': 0}
+        self._context = multiprocessing.get_context('spawn')
+        self._loop = None
+        self._idle = None
+        self._live = set()
+        self._active = 0
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _start_worker(self):
+        worker = _Worker(self._context, self.cache, self._loop)
+        self._live.add(worker)
+        self._idle.put_nowait(worker)
+
+    def _retire(self, worker, healthy):
+        "Put a worker back once its job is done, or replace it."
+        worker.busy = False
+        worker.jobs += 1
+        if healthy and worker.jobs < self.max_jobs_per_worker:
+            self._idle.put_nowait(worker)
+            return
+        self._live.discard(worker)
+        if healthy:
+            worker.stop()
+        else:
+            worker.kill()
+        if not self._closed:
+            self._start_worker()
+
+    async def check(self, step_path, kerf_width=None, timeout=None,
+                    progress=None, **options):
+        """Check a file on one of the workers.
+
+        Returns (result, error) as for paperlesscad.batch.check_many.  Other
+        keyword options are passed on to dfm_check, and must be picklable.
+        progress, if given, is called with the name of each check as it
+        finishes.
+
+        Raises asyncio.QueueFull, without waiting, if too many checks are
+        already running or waiting.  Raises asyncio.TimeoutError if the check
+        takes longer than timeout seconds, including any time spent waiting
+        for a worker.  A check that times out or is cancelled has its worker
+        killed.
+
+        """
+        if self._closed:
+            raise RuntimeError('AsyncChecker is closed')
+        if self._active >= self.workers + self.max_queued:
+            self.stats['rejected'] += 1
+            raise asyncio.QueueFull()
+        if self._idle is None:
+            self._loop = asyncio.get_running_loop()
+            self._idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self._start_worker()
+        options['kerf_width'] = kerf_width
+        self._active += 1
+        try:
+            kind, value = await asyncio.wait_for(
+                self._run(step_path, options, progress), timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed_out'] += 1
+            raise
+        finally:
+            self._active -= 1
+        if kind == 'result':
+            self.stats['completed'] += 1
+            return value, None
+        self.stats['failed'] += 1
+        if kind == 'exit':
+            return None, 'Worker process exited while checking {}'.format(
+                step_path)
+        return None, value
+
+    async def _run(self, step_path, options, progress):
+        "Run one job on the next idle worker, returning its last message."
+        worker = await self._idle.get()
+        worker.busy = True
+        kind = None
+        try:
+            try:
+                worker.conn.send((step_path, options))
+            except (OSError, ValueError):
+                # The worker has already exited.
+                return 'exit', None
+            while True:
+                kind, value = await worker.messages.get()
+                if kind != 'progress':
+                    return kind, value
+                if progress is not None:
+                    progress(value)
+        finally:
+            # A job that did not finish, whether it failed, timed out or was
+            # cancelled, may have left the worker stuck.
+            self._retire(worker, kind in ('result', 'error'))
+
+    async def close(self):
+        """Stop all workers, and wait for them to exit.
+
+        Checks still running are ended, and return an error.
+
+        """
+        self._closed = True
+        for worker in list(self._live):
+            if worker.busy:
+                worker.kill()
+            else:
+                worker.stop()
+        threads = [w.thread for w in self._live]
+        self._live.clear()
+        loop = asyncio.get_running_loop()
+        for thread in threads:
+            await loop.run_in_executor(None, thread.join)
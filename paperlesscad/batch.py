@@ -0,0 +1,122 @@
+"""Checking of many STEP files at once, spread across worker processes.
+
+Can also be run from the command line, printing one JSON line per file:
+
+    python -m paperlesscad.batch step_files/*.STEP
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import sys
+import threading
+from multiprocessing import cpu_count
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from paperlesscad.workers import Worker
+
+
+def check_many(step_paths, processes=None, cache=None, maxtasksperchild=None,
+               timeout=None):
+    """Check an iterable of STEP files using worker processes.
+
+    Yields a (step_path, result, error) tuple for each file as soon as it is
+    done, so the order will generally not match the input.  If checking a file
+    fails, result is None and error says why; the rest of the files are still
+    checked.  That includes a file that takes longer than timeout seconds, or
+    makes FreeCAD crash outright, whose worker is then replaced.
+
+    processes defaults to the number of CPUs.  Workers can be replaced after
+    maxtasksperchild files to limit memory growth.  A ResultCache may be given
+    as cache, which all workers will share.
+
+    """
+    paths = iter(step_paths)
+    lock = threading.Lock()
+    done = Queue()
+    stopping = threading.Event()
+    workers = []
+
+    def next_path():
+        "Next (step_path,) to check, or None once there are no more."
+        with lock:
+            if stopping.is_set():
+                return None
+            try:
+                return (next(paths),)
+            except StopIteration:
+                return None
+
+    def work(k):
+        # Each thread hands its files, one at a time, to a worker of its own.
+        try:
+            while True:
+                item = next_path()
+                if item is None:
+                    return
+                worker = workers[k]
+                if worker is not None and maxtasksperchild and (
+                        worker.jobs >= maxtasksperchild):
+                    worker.stop()
+                if worker is None or not worker.alive:
+                    with lock:
+                        if stopping.is_set():
+                            return
+                        worker = workers[k] = Worker(cache)
+                result, error = worker.check(item[0], timeout)
+                done.put((item[0], result, error))
+        finally:
+            done.put(None)
+
+    n_threads = processes or cpu_count()
+    threads = []
+    for k in range(n_threads):
+        workers.append(None)
+        thread = threading.Thread(target=work, args=(k,))
+        thread.daemon = True
+        threads.append(thread)
+        thread.start()
+    try:
+        running = n_threads
+        while running:
+            item = done.get()
+            if item is None:
+                running -= 1
+            else:
+                yield item
+    finally:
+        with lock:
+            stopping.set()
+        for worker in workers:
+            if worker is not None and worker.alive:
+                worker.kill()
+        for thread in threads:
+            thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('step_paths', nargs='+', metavar='step_path')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds to allow for each file (default: none)')
+    args = parser.parse_args(argv)
+    failed = False
+    for step_path, result, error in check_many(args.step_paths,
+                                               args.processes,
+                                               timeout=args.timeout):
+        failed = failed or error is not None
+        print(json.dumps({'path': step_path, 'result': result,
+                          'error': error}))
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Benchmarks of dfm_check run time and memory use.
+
+Times dfm_check on every file in step_files/ and on synthetic plates of
+increasing size, made with FreeCAD, to show how the checks scale with the
+number of faces.  Run from the repository root:
+
+    python -m paperlesscad.benchmark --output bench.json
+
+Results are saved as JSON.  A later run can be compared against them with
+--compare, which lists every case that got slower by more than --threshold
+and exits with an error if there are any.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from math import cos, pi, sin
+from multiprocessing import Pool
+
+import FreeCAD
+import Part
+
+from paperlesscad.solution import DETECTOR_VERSION, dfm_check
+
+
+def make_hole_grid(path, n, m, pitch=10.0, radius=2.0, thickness=3.0):
+    "Plate with an n by m grid of round holes."
+    plate = Part.makeBox(n * pitch, m * pitch, thickness)
+    holes = [Part.makeCylinder(radius, thickness,
+                               FreeCAD.Vector((i + 0.5) * pitch,
+                                              (j + 0.5) * pitch, 0))
+             for i in range(n) for j in range(m)]
+    plate.cut(Part.makeCompound(holes)).exportStep(path)
+
+
+def make_slot_array(path, n, pitch=5.0, length=40.0, width=2.0,
+                    thickness=3.0):
+    "Plate with n parallel round-ended slots, close enough to be small cuts."
+    plate = Part.makeBox(length + 2 * pitch, n * pitch + pitch, thickness)
+    slots = []
+    for i in range(n):
+        y = (i + 1) * pitch
+        slots.append(Part.makeBox(length, width, thickness,
+                                  FreeCAD.Vector(pitch, y - width / 2, 0)))
+        for x in (pitch, pitch + length):
+            slots.append(Part.makeCylinder(width / 2, thickness,
+                                           FreeCAD.Vector(x, y, 0)))
+    plate.cut(Part.makeCompound(slots)).exportStep(path)
+
+
+def make_spline_outline(path, n, radius=50.0, wobble=5.0, thickness=3.0):
+    "Plate whose outline is a closed spline through n wavy points."
+    points = []
+    for k in range(n):
+        r = radius + wobble * (-1) ** k
+        angle = 2 * pi * k / n
+        points.append(FreeCAD.Vector(r * cos(angle), r * sin(angle), 0))
+    curve = Part.BSplineCurve()
+    curve.interpolate(points, PeriodicFlag=True)
+    face = Part.Face(Part.Wire(curve.toShape()))
+    face.extrude(FreeCAD.Vector(0, 0, thickness)).exportStep(path)
+
+
+def synthetic_cases(directory, sizes):
+    "Write synthetic parts into a directory, returning (name, path) pairs."
+    cases = []
+    for size in sizes:
+        for name, make, args in (
+                ('holes_{0}x{0}', make_hole_grid, (size, size)),
+                ('slots_{0}', make_slot_array, (size,)),
+                ('spline_{0}', make_spline_outline, (4 * size,))):
+            name = name.format(size)
+            path = os.path.join(directory, name + '.step')
+            make(path, *args)
+            cases.append((name, path))
+    return cases
+
+
+# Counters from dfm_check that add up to the number of faces in a part.
+_FACE_COUNTERS = ('faces_plane', 'faces_cylinder', 'faces_cone',
+                  'faces_sphere_or_torus', 'faces_other')
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _time_case(args):
+    """Time dfm_check on one file, in a fresh worker process.
+
+    The worker starts as a copy of the benchmark process, with FreeCAD already
+    loaded, so its peak memory (peak_rss_kb) includes all of that.
+    rss_growth_kb is how far the case pushed the peak above where it started,
+    which is the part that belongs to the case.  The face count is 0 for parts
+    rejected before they are loaded.
+
+    """
+    name, path, repeat = args
+    start_rss = _peak_rss_kb()
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = dfm_check(path, instrument=True)
+        times.append(time.time() - start)
+    counters = result['metrics']['counters']
+    peak_rss = _peak_rss_kb()
+    return {'name': name,
+            'faces': sum(counters.get(c, 0) for c in _FACE_COUNTERS),
+            'seconds': min(times),
+            'all_seconds': times,
+            'peak_rss_kb': peak_rss,
+            'rss_growth_kb': peak_rss - start_rss,
+            'issues': len(result['issues']),
+            'counters': counters}
+
+
+def run(step_dir='step_files', sizes=(2, 4, 8, 16), repeat=3):
+    "Run all benchmarks, returning the results as plain data."
+    cases = [(os.path.basename(p), p, repeat)
+             for p in sorted(glob.glob(os.path.join(step_dir, '*')))]
+    directory = tempfile.mkdtemp()
+    try:
+        cases.extend((name, path, repeat)
+                     for name, path in synthetic_cases(directory, sizes))
+        pool = Pool(1, maxtasksperchild=1)
+        try:
+            results = pool.map(_time_case, cases, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(directory)
+    return {'detector_version': DETECTOR_VERSION,
+            'freecad_version': FreeCAD.Version()[:3],
+            'python_version': platform.python_version(),
+            'machine': platform.machine(),
+            'timestamp': time.time(),
+            'results': results}
+
+
+def compare(baseline, current, threshold=1.25):
+    """List the cases that got slower by more than a factor of threshold.
+
+    Returns a list of (name, old seconds, new seconds).
+
+    """
+    old = {r['name']: r['seconds'] for r in baseline['results']}
+    return [(r['name'], old[r['name']], r['seconds'])
+            for r in current['results']
+            if r['name'] in old and r['seconds'] > threshold * old[r['name']]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='file to save results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown factor counted as a regression')
+    parser.add_argument('--sizes', default='2,4,8,16',
+                        help='comma-separated sizes of synthetic parts')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case; the fastest is reported')
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    results = run(sizes=sizes, repeat=args.repeat)
+
+    for r in results['results']:
+        print('{name:40} {faces:6d} faces {seconds:9.3f} s '
+              '{rss_growth_kb:9d} kB'.format(**r))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        for name, old, new in regressions:
+            print('REGRESSION {}: {:.3f} s -> {:.3f} s'.format(name, old, new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""Persistent caching of parsed parts and analysis results on disk."""
+
+from __future__ import absolute_import, division
+
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+def file_digest(path, chunk_size=1 << 20):
+    "Calculate the SHA-256 hex digest of a file's contents."
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _ignore_missing(func, *args):
+    """Call func, ignoring the error if the file it acts on is already gone.
+
+    Another process sharing the same cache directory may have removed the file
+    first, which is not a problem.
+
+    """
+    try:
+        return func(*args)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class DirectoryCache(object):
+    """Directory of cached entries, one file per entry named by its key.
+
+    Entries are written to a temporary file and renamed into place, so any
+    number of processes can share one directory without ever reading a
+    partially written entry.  An entry's modification time is updated whenever
+    it is read, so that eviction removes the least recently used entries
+    first.  Subclasses set the file suffix, and say how entries are written
+    and read.
+
+    Any of the limits may be None, meaning no limit.  max_age is in seconds.
+    With no limits, entries are never evicted.  Otherwise the number and size
+    of entries are kept as running totals, so the directory is only listed
+    on the first write, when the totals go over a limit, and after every
+    rescan_every writes, which is when writes by other processes and expired
+    entries are noticed.
+
+    """
+    suffix = None
+    rescan_every = 100
+
+    def __init__(self, directory, max_entries=None, max_bytes=None,
+                 max_age=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Running totals of entries and their bytes, as of the last rescan.
+        self._count = None
+        self._bytes = None
+        self._writes = 0
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _is_expired(self, mtime, now):
+        return self.max_age is not None and now - mtime > self.max_age
+
+    def _read(self, key, load):
+        """Read an entry with load(file), or return None if there is none.
+
+        Entries that cannot be loaded count as missing.
+
+        """
+        path = self._path(key)
+        entry = None
+        try:
+            if not self._is_expired(os.path.getmtime(path), time.time()):
+                with open(path, 'rb') as f:
+                    entry = load(f)
+        except (IOError, OSError, ValueError):
+            pass
+        if entry is None:
+            self.misses += 1
+            return None
+        _ignore_missing(os.utime, path, None)
+        self.hits += 1
+        return entry
+
+    def _has_limits(self):
+        return not (self.max_entries is None and self.max_bytes is None
+                    and self.max_age is None)
+
+    def _write(self, key, dump):
+        "Write an entry with dump(file), then evict entries if over a limit."
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                dump(f)
+                size = f.tell()
+            replaced = None
+            if self._count is not None:
+                try:
+                    replaced = os.path.getsize(path)
+                except OSError:
+                    pass
+            os.rename(tmp_path, path)
+        except Exception:
+            _ignore_missing(os.remove, tmp_path)
+            raise
+        if not self._has_limits():
+            return
+        self._writes += 1
+        if self._count is None or self._writes >= self.rescan_every:
+            self.evict()
+            return
+        if replaced is None:
+            self._count += 1
+            self._bytes += size
+        else:
+            self._bytes += size - replaced
+        if ((self.max_entries is not None and self._count > self.max_entries)
+                or (self.max_bytes is not None
+                    and self._bytes > self.max_bytes)):
+            self.evict()
+
+    def _entries(self):
+        "List (mtime, size, path) of all entries, oldest first."
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        "Remove expired entries, then the oldest until within size limits."
+        now = time.time()
+        entries = []
+        for mtime, size, path in self._entries():
+            if self._is_expired(mtime, now):
+                _ignore_missing(os.remove, path)
+                self.evictions += 1
+            else:
+                entries.append((mtime, size, path))
+        count = len(entries)
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            too_many = (self.max_entries is not None
+                        and count > self.max_entries)
+            too_big = (self.max_bytes is not None
+                       and total_bytes > self.max_bytes)
+            if not (too_many or too_big):
+                break
+            _ignore_missing(os.remove, path)
+            self.evictions += 1
+            count -= 1
+            total_bytes -= size
+        self._count = count
+        self._bytes = total_bytes
+        self._writes = 0
+
+    def stats(self):
+        "Summarize cache use by this object and the current cache contents."
+        entries = self._entries()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries)}
+
+    def clear(self):
+        "Remove every entry from the cache."
+        for _, _, path in self._entries():
+            _ignore_missing(os.remove, path)
+        self._count = None
+
+
+class ResultCache(DirectoryCache):
+    "Directory of cached dfm_check results as JSON, keyed on file content."
+    suffix = '.json'
+
+    @staticmethod
+    def key(digest, kerf_width, version, options=()):
+        """Build a cache key.
+
+        digest is the hash of the STEP file's contents and version is the
+        detector version.  A kerf_width of None means that it is derived from
+        the part itself, which is fully determined by the file contents.
+        options names any optional parts of the result that were asked for.
+
+        """
+        kerf = 'auto' if kerf_width is None else repr(float(kerf_width))
+        text = '{}|{}|{}|{}'.format(digest, kerf, version,
+                                    ','.join(sorted(options)))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        "Return the cached result for a key, or None if there is none."
+        return self._read(key, lambda f: json.loads(f.read().decode('utf-8')))
+
+    def put(self, key, result):
+        "Store a result, then evict old entries if over any limit."
+        self._write(key, lambda f: f.write(json.dumps(result).encode('utf-8')))
+
+
+def _load_geometry(f):
+    """Read a GeometryCache entry, returning (shape, face_edges).
+
+    Returns None if the entry cannot be read, or the shape does not have the
+    faces and edges it had when it was stored, so that the part is loaded
+    from its STEP file again and the entry replaced.
+
+    """
+    # FreeCAD is only needed for this kind of cache, so only load it here.
+    import Part
+    try:
+        header = json.loads(f.readline().decode('utf-8'))
+        faces = header['faces']
+        edges = header['edges']
+        face_edges = header['face_edges']
+        shape = Part.Shape()
+        shape.importBrepFromString(f.read().decode('utf-8'))
+    except Exception:
+        # Errors from OCC's BREP reader have no common type across versions
+        # of FreeCAD, and a broken entry must never stop a check.
+        return None
+    if (len(shape.Faces), len(shape.Edges)) != (faces, edges):
+        return None
+    return shape, face_edges
+
+
+class GeometryCache(DirectoryCache):
+    """Directory of parsed parts, keyed on the content of their STEP files.
+
+    Parts are stored in OCC's native BREP format, which loads much faster than
+    STEP.  The edges of each face are stored alongside, so that the part's
+    Topology can be rebuilt without looking at every face again.  Unlike
+    ResultCache, entries stay useful whatever the settings or version of the
+    checks.
+
+    """
+    suffix = '.brep'
+
+    # Change this whenever the layout of entries changes.
+    FORMAT_VERSION = '1'
+
+    @classmethod
+    def key(cls, digest):
+        "Build a cache key from the hash of a STEP file's contents."
+        text = '{}|brep|{}'.format(digest, cls.FORMAT_VERSION)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        "Return (shape, face_edges) for a key, or None if there is none."
+        return self._read(key, _load_geometry)
+
+    def put(self, key, shape, topology):
+        "Store a shape and its Topology, then evict entries if over a limit."
+        header = {'faces': len(topology.faces),
+                  'edges': len(topology.edges),
+                  'face_edges': [list(topology.edges_of_face(i))
+                                 for i in range(len(topology.faces))]}
+
+        def dump(f):
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(shape.exportBrepToString().encode('utf-8'))
+        self._write(key, dump)
@@ -0,0 +1,156 @@
+"""Reuse of per-face and per-pair results between revisions of a part.
+
+A new revision of a part usually keeps most of its faces exactly as they were.
+Each face is given a fingerprint from its geometry, and the results of the
+expensive checks on a face, or on a pair of faces, are stored under their
+fingerprints.  Checking the next revision with the same state then only does
+that work again for faces that were added or changed.  Everything else about
+the checks (adjacency, corners, and so on) is worked out afresh each time, so
+the result is always the same as a full run.
+
+"""
+
+from __future__ import absolute_import, division
+
+import hashlib
+import json
+import os
+import tempfile
+
+from paperlesscad.cache import _ignore_missing
+
+
+# Numbers are rounded to this many decimal places in fingerprints, so that
+# faces read from different files in exactly the same place still match.
+DIGITS = 9
+
+# Surface properties that go into a face's fingerprint, where the surface has
+# them.
+_SURFACE_PROPERTIES = ('Position', 'Center', 'Apex', 'Axis', 'Direction',
+                       'Radius', 'MajorRadius', 'MinorRadius', 'SemiAngle')
+
+
+def _rounded(value):
+    if hasattr(value, 'x'):
+        return tuple(round(c, DIGITS) for c in (value.x, value.y, value.z))
+    return round(value, DIGITS)
+
+
+def face_fingerprint(face):
+    """Fingerprint of a face's geometry, as a hex string.
+
+    Built from the surface type and parameters, the orientation, area and
+    bounding box, the vertices and edge lengths, and points sampled across the
+    face.  Faces with the same fingerprint can be treated as the same face.
+
+    """
+    surface = face.Surface
+    parts = [type(surface).__name__, face.Orientation, _rounded(face.Area)]
+    for name in _SURFACE_PROPERTIES:
+        try:
+            parts.append((name, _rounded(getattr(surface, name))))
+        except (AttributeError, TypeError):
+            pass
+    bb = face.BoundBox
+    parts.append(tuple(_rounded(c) for c in (bb.XMin, bb.YMin, bb.ZMin,
+                                             bb.XMax, bb.YMax, bb.ZMax)))
+    parts.append(sorted(_rounded(v.Point) for v in face.Vertexes))
+    parts.append(sorted(_rounded(e.Length) for e in face.Edges))
+    u1, u2, v1, v2 = face.ParameterRange
+    for a in (0.25, 0.5, 0.75):
+        for b in (0.25, 0.5, 0.75):
+            parts.append(_rounded(face.valueAt(u1 + a * (u2 - u1),
+                                               v1 + b * (v2 - v1))))
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+class IncrementalState(object):
+    """Results of checks on faces and pairs of faces, keyed by fingerprint.
+
+    Pass the same state to dfm_check for each revision of a part.  It can be
+    saved to a JSON file between runs.  Results stored under a different
+    version of the checks are never used.  hits and misses count lookups since
+    the state was made.
+
+    """
+
+    def __init__(self, version, entries=None):
+        self.version = version
+        self.entries = {} if entries is None else entries
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path, version):
+        """Read a state from a file.
+
+        Returns an empty state if the file does not exist or was written for a
+        different version of the checks.
+
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return cls(version)
+        if data.get('version') != version:
+            return cls(version)
+        return cls(version, data['entries'])
+
+    def save(self, path):
+        "Write the state to a file, replacing it in one step."
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': self.version, 'entries': self.entries},
+                          f)
+            os.rename(tmp_path, path)
+        except Exception:
+            _ignore_missing(os.remove, tmp_path)
+            raise
+
+    def reset(self, version):
+        "Forget everything, and store results for another version from now on."
+        self.version = version
+        self.entries = {}
+        self.used = set()
+
+    @staticmethod
+    def face_key(check, fingerprint, *options):
+        "Key for the result of a check on one face."
+        return '|'.join([check, fingerprint] + [str(o) for o in options])
+
+    @staticmethod
+    def pair_key(check, fingerprint1, fingerprint2, kerf_width):
+        """Key for the result of a check on a pair of faces.
+
+        Only for checks whose result does not depend on the order of the pair.
+
+        """
+        return '|'.join([check] + sorted([fingerprint1, fingerprint2])
+                        + [repr(float(kerf_width))])
+
+    def get(self, key):
+        "Return the stored result for a key, or None if there is none."
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used.add(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.used.add(key)
+
+    def forget_unused(self):
+        """Remove every result that has not been used since the state was made.
+
+        Keeps the state from growing without limit over many revisions.
+
+        """
+        self.entries = {k: v for k, v in self.entries.items()
+                        if k in self.used}
@@ -0,0 +1,54 @@
+"""Timing and counting of the work done within dfm_check."""
+
+from __future__ import absolute_import, division
+
+import time
+from collections import defaultdict
+
+
+class Instrumentation(object):
+    """Record of wall time spent in each phase of a check, plus counters.
+
+    Phases are timed back to back: starting a phase ends the previous one.
+    Time spent in a phase that is started more than once is added together.
+
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._phase = None
+        self._start = None
+
+    def begin(self, phase):
+        "Start timing a new phase, ending the current one if any."
+        now = time.time()
+        if self._phase is not None:
+            self.timings[self._phase] += now - self._start
+        self._phase = phase
+        self._start = now
+
+    def end(self):
+        "Stop timing the current phase."
+        self.begin(None)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def as_dict(self):
+        "All recorded values, as plain data that can be turned into JSON."
+        return {'timings': dict(self.timings),
+                'counters': dict(self.counters)}
+
+
+class NullInstrumentation(object):
+    "Stand-in for Instrumentation that records nothing, for when it is off."
+
+    def begin(self, phase):
+        pass
+
+    def end(self):
+        pass
+
+    def count(self, name, n=1):
+        pass
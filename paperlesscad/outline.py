@@ -0,0 +1,122 @@
+"""2D outlines of parts that are a flat profile extruded straight up.
+
+Once a part is known to have only a top face, a bottom face and vertical walls
+running the full thickness between them, every wall is just its top edge swept
+downwards.  The distance between two such walls is then the distance between
+their top edges in the XY plane, which can be found from polylines with NumPy
+much faster than with OCC.
+
+"""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+from paperlesscad.utils import is_close
+
+
+# Walls must reach the top and bottom faces to within this distance.
+Z_TOLERANCE = 1e-7
+
+
+class Profile(object):
+    """Outline of a uniform-thickness part, as polylines per wall face.
+
+    outlines maps the index of each wall face to an (n, 2, 2) array of line
+    segments in the XY plane, which stay within deflection of the true edges.
+    z is the height half way between the top and bottom faces.
+
+    """
+
+    def __init__(self, outlines, deflection, z):
+        self.outlines = outlines
+        self.deflection = deflection
+        self.z = z
+
+    def distance(self, i1, i2):
+        """Distance between the outlines of two wall faces.
+
+        Returns (distance, point1, point2), with the points being the closest
+        points on each outline.  The distance is within twice deflection of the
+        true distance between the faces.
+
+        """
+        return segments_distance(self.outlines[i1], self.outlines[i2])
+
+
+def _point_segment_distance(points, segments):
+    """Distances from every point to every segment.
+
+    Returns (distances, closest), of shapes (n_points, n_segments) and
+    (n_points, n_segments, 2).
+
+    """
+    start = segments[np.newaxis, :, 0, :]
+    direction = segments[np.newaxis, :, 1, :] - start
+    length2 = (direction ** 2).sum(axis=2)
+    offset = points[:, np.newaxis, :] - start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length2 > 0, (offset * direction).sum(axis=2) / length2,
+                     0.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest = start + t[:, :, np.newaxis] * direction
+    gap = points[:, np.newaxis, :] - closest
+    distances = np.sqrt((gap ** 2).sum(axis=2))
+    return distances, closest
+
+
+def segments_distance(segments1, segments2):
+    """Smallest distance between two sets of 2D line segments.
+
+    Returns (distance, point1, point2).
+
+    NOTE Segments that cross each other are not detected.  Walls of a valid
+    solid cannot cross, so the smallest distance is always found at an end of
+    one of the segments.
+
+    """
+    points1 = segments1.reshape(-1, 2)
+    points2 = segments2.reshape(-1, 2)
+    d12, closest12 = _point_segment_distance(points1, segments2)
+    d21, closest21 = _point_segment_distance(points2, segments1)
+    k12 = np.unravel_index(np.argmin(d12), d12.shape)
+    k21 = np.unravel_index(np.argmin(d21), d21.shape)
+    if d12[k12] <= d21[k21]:
+        return d12[k12], points1[k12[0]], closest12[k12]
+    return d21[k21], closest21[k21], points2[k21[0]]
+
+
+def extract_profile(a, deflection):
+    """Build the Profile of the part being checked in an Analysis.
+
+    Returns None unless the part is exactly a top face, a bottom face and
+    vertical walls that each run all the way between them.
+
+    """
+    if len(a.horizontal_planes) != 2:
+        return None
+    if a.cones or a.angled_planes or a.cylinders - a.vertical_cylinders:
+        return None
+    zmin = a.shape.BoundBox.ZMin
+    zmax = a.shape.BoundBox.ZMax
+    info = a.face_info
+    bottom, top = sorted(a.horizontal_planes, key=lambda p: info[p].zmin)
+    if not (is_close(info[bottom].zmax, zmin, Z_TOLERANCE)
+            and is_close(info[top].zmin, zmax, Z_TOLERANCE)):
+        return None
+
+    top_edges = set(a.topology.edges_of_face(top))
+    outlines = {}
+    for i in a.all_faces - a.horizontal_planes:
+        if not (is_close(info[i].zmin, zmin, Z_TOLERANCE)
+                and is_close(info[i].zmax, zmax, Z_TOLERANCE)):
+            return None
+        segments = []
+        for e in top_edges.intersection(a.topology.edges_of_face(i)):
+            points = a.edges[e].discretize(Deflection=deflection)
+            xy = np.array([(p.x, p.y) for p in points])
+            segments.append(np.stack([xy[:-1], xy[1:]], axis=1))
+        if not segments:
+            return None
+        outlines[i] = np.concatenate(segments)
+    return Profile(outlines, deflection, 0.5 * (zmin + zmax))
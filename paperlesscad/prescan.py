@@ -0,0 +1,241 @@
+"""Quick scan of the text of a STEP file, without loading its geometry.
+
+Reading a STEP file into OCC is slow, and for parts that are clearly outside
+the problem space the result is always "non-uniform".  This scan streams
+through the file, splitting it into entities and counting their types, so that
+some of those parts can be answered without loading them at all.  It also
+finds the units, a rough bounding box and an estimate of the number of faces,
+which say roughly how much work a full check of the file will be.
+
+Can also be run from the command line, printing one JSON line per file:
+
+    python -m paperlesscad.prescan step_files/*.STEP
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import io
+import json
+import re
+import sys
+from collections import Counter
+
+
+# Files are read this many characters at a time.
+CHUNK_SIZE = 1 << 16
+
+# Surface types that always make a part "non-uniform" when any face uses them.
+BAD_SURFACES = frozenset(['SPHERICAL_SURFACE', 'TOROIDAL_SURFACE'])
+
+_SPECIAL = re.compile(r"[;'/]")
+_ENTITY = re.compile(r'#(\d+)\s*=\s*(.*)$', re.S)
+_SIMPLE = re.compile(r'([A-Z_][A-Z0-9_]*)\s*\((.*)\)$', re.S)
+_COMPLEX_PART = re.compile(r'(?:^\(|\))\s*([A-Z_][A-Z0-9_]*)\s*\(')
+_FACE_SURFACE = re.compile(r'#(\d+)\s*,\s*\.[TF]\.\s*$')
+_SI_UNIT = re.compile(r'SI_UNIT\s*\(\s*(?:\.(\w+)\.|\$)\s*,\s*\.(\w+)\.')
+_CONVERSION_UNIT = re.compile(r"CONVERSION_BASED_UNIT\s*\(\s*'([^']*)'")
+_POINT = re.compile(r"\(\s*([^(),]+),\s*([^(),]+),\s*([^(),]+)\)\s*$")
+_UNIT_KINDS = {'LENGTH_UNIT': 'length',
+               'PLANE_ANGLE_UNIT': 'plane_angle',
+               'SOLID_ANGLE_UNIT': 'solid_angle'}
+
+
+def _statements(f, chunk_size=CHUNK_SIZE):
+    """Split STEP text into statements, without their ending semicolons.
+
+    Only one statement is held in memory at a time.  Semicolons within strings
+    are not treated as the end of a statement, and comments are dropped.
+
+    """
+    statement = []
+    # None normally, "'" within a string, or '*' within a comment.  An escaped
+    # quote ('') within a string ends it and starts it again straight away,
+    # which comes to the same thing.
+    state = None
+    carry = ''
+    while True:
+        chunk = f.read(chunk_size)
+        text = carry + chunk
+        carry = ''
+        pos = 0
+        while pos < len(text):
+            if state == '*':
+                end = text.find('*/', pos)
+                if end < 0:
+                    # Keep a possible first half of "*/" for the next chunk.
+                    if chunk and text.endswith('*'):
+                        carry = '*'
+                    break
+                state = None
+                pos = end + 2
+            elif state == "'":
+                end = text.find("'", pos)
+                if end < 0:
+                    statement.append(text[pos:])
+                    break
+                statement.append(text[pos:end + 1])
+                state = None
+                pos = end + 1
+            else:
+                match = _SPECIAL.search(text, pos)
+                if match is None:
+                    statement.append(text[pos:])
+                    break
+                k = match.start()
+                if text[k] == ';':
+                    statement.append(text[pos:k])
+                    yield ''.join(statement).strip()
+                    statement = []
+                    pos = k + 1
+                elif text[k] == "'":
+                    statement.append(text[pos:k + 1])
+                    state = "'"
+                    pos = k + 1
+                elif k == len(text) - 1 and chunk:
+                    # Keep a possible first half of "/*" for the next chunk.
+                    statement.append(text[pos:k])
+                    carry = '/'
+                    break
+                elif text.startswith('/*', k):
+                    statement.append(text[pos:k])
+                    state = '*'
+                    pos = k + 2
+                else:
+                    statement.append(text[pos:k + 1])
+                    pos = k + 1
+        if not chunk:
+            break
+
+
+class ScanResult(object):
+    """What the scan of a STEP file found.
+
+    types counts the entities of each type, with each part of a complex entity
+    counted separately.  units maps 'length', 'plane_angle' and 'solid_angle'
+    to the names of the units declared for them, such as 'MILLIMETRE' or
+    'INCH'.  extents is the box (xmin, ymin, zmin, xmax, ymax, zmax) around
+    every 3D point in the file, in its length units, or None if there were
+    none.  That includes points such as spline poles, so it can be larger than
+    the part itself.  bad_faces counts the faces whose surface is one of
+    BAD_SURFACES.
+
+    """
+
+    def __init__(self, types, units, extents, bad_faces):
+        self.types = types
+        self.units = units
+        self.extents = extents
+        self.bad_faces = bad_faces
+
+    @property
+    def faces(self):
+        "Estimate of the number of faces that OCC will find in the file."
+        return self.types['ADVANCED_FACE'] + self.types['FACE_SURFACE']
+
+    @property
+    def non_uniform(self):
+        "Whether the part is certain to be reported as 'non-uniform'."
+        return self.bad_faces > 0
+
+    def as_dict(self):
+        "Everything found, as plain data that can be turned into JSON."
+        return {'types': dict(self.types),
+                'units': self.units,
+                'extents': self.extents and list(self.extents),
+                'faces': self.faces,
+                'bad_faces': self.bad_faces,
+                'non_uniform': self.non_uniform}
+
+
+def scan_text(f, chunk_size=CHUNK_SIZE):
+    "Scan STEP text read from a file object, returning a ScanResult."
+    types = Counter()
+    units = {}
+    low = [float('inf')] * 3
+    high = [float('-inf')] * 3
+    # Surfaces used by faces, and which of those are bad, are collected
+    # separately since entities can refer to ones that come later in the file.
+    face_surfaces = Counter()
+    bad_surfaces = set()
+    for statement in _statements(f, chunk_size):
+        entity = _ENTITY.match(statement)
+        if entity is None:
+            continue
+        number, body = entity.groups()
+        simple = _SIMPLE.match(body)
+        if simple is None:
+            parts = _COMPLEX_PART.findall(body)
+            types.update(parts)
+            kinds = [_UNIT_KINDS[p] for p in parts if p in _UNIT_KINDS]
+            if kinds:
+                si = _SI_UNIT.search(body)
+                conversion = _CONVERSION_UNIT.search(body)
+                if si is not None:
+                    units[kinds[0]] = (si.group(1) or '') + si.group(2)
+                elif conversion is not None:
+                    units[kinds[0]] = conversion.group(1).upper()
+            continue
+        name, args = simple.groups()
+        types[name] += 1
+        if name == 'CARTESIAN_POINT':
+            point = _POINT.search(args)
+            if point is not None:
+                for k, value in enumerate(point.groups()):
+                    value = float(value)
+                    low[k] = min(low[k], value)
+                    high[k] = max(high[k], value)
+        elif name in ('ADVANCED_FACE', 'FACE_SURFACE'):
+            surface = _FACE_SURFACE.search(args)
+            if surface is not None:
+                face_surfaces[int(surface.group(1))] += 1
+        elif name in BAD_SURFACES:
+            bad_surfaces.add(int(number))
+
+    extents = tuple(low + high) if low[0] <= high[0] else None
+    bad_faces = sum(face_surfaces[s] for s in bad_surfaces)
+    return ScanResult(types, units, extents, bad_faces)
+
+
+def scan(step_path, chunk_size=CHUNK_SIZE):
+    "Scan a STEP file, returning a ScanResult."
+    with io.open(step_path, encoding='latin-1') as f:
+        return scan_text(f, chunk_size)
+
+
+def mentions(step_path, words, chunk_size=CHUNK_SIZE):
+    """Check whether any of the given words appear anywhere in a file.
+
+    Much quicker than a full scan, so it can be used to decide whether a full
+    scan is worth doing.
+
+    """
+    words = [w.encode('ascii') for w in words]
+    overlap = max(len(w) for w in words) - 1
+    tail = b''
+    with open(step_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return False
+            text = tail + chunk
+            if any(w in text for w in words):
+                return True
+            tail = text[-overlap:] if overlap else b''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('step_paths', nargs='+', metavar='STEP_FILE')
+    args = parser.parse_args(argv)
+    for path in args.step_paths:
+        record = scan(path).as_dict()
+        record['path'] = path
+        print(json.dumps(record, sort_keys=True))
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""Sampling of surface normals over the parameter space of a face.
+
+Used to decide whether a freeform face (B-spline, extrusion, etc.) is a
+vertical wall, by checking that none of its normals have a vertical component.
+Normals are evaluated a whole batch at a time into NumPy arrays: B-spline
+surfaces are evaluated directly from their poles and knots, and extrusions
+only need one normal per u parameter since their normals do not change along
+the extrusion direction.  Anything else falls back to one normalAt call per
+point.
+
+"""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+import Part
+
+
+# Vertical normal components within this factor of the tolerance are too close
+# to call using the NumPy evaluation alone, and are rechecked with OCC.
+NEAR_FACTOR = 10
+
+
+def grid_levels(n_points):
+    """Split an n_points by n_points grid of indices into levels.
+
+    Each level is an array of (a, b) index pairs.  The first level is a coarse
+    grid across the whole face, and each following level fills in the points
+    between, so that every grid point appears exactly once overall.  Checking
+    the levels in order finds problems anywhere on the face quickly.
+
+    """
+    stride = 1
+    while stride * 2 < n_points:
+        stride *= 2
+    seen = np.zeros((n_points, n_points), dtype=bool)
+    levels = []
+    while stride >= 1:
+        mask = np.zeros_like(seen)
+        mask[::stride, ::stride] = True
+        mask &= ~seen
+        seen |= mask
+        levels.append(np.argwhere(mask))
+        stride //= 2
+    return levels
+
+
+def _flat_knots(knots, mults):
+    return np.repeat(np.asarray(knots, dtype=float), mults)
+
+
+def _basis(knots, degree, t):
+    """Evaluate all B-spline basis functions and their derivatives.
+
+    Returns (N, dN), each of shape (len(t), n_poles).
+
+    """
+    t = np.clip(t, knots[degree], knots[-degree - 1])
+    n_spans = len(knots) - 1
+    # Degree zero basis functions are 1 within their knot span.  Points on the
+    # very last knot belong to the last non-empty span.
+    left = knots[:-1][np.newaxis, :]
+    right = knots[1:][np.newaxis, :]
+    tt = t[:, np.newaxis]
+    N = ((left <= tt) & (tt < right)).astype(float)
+    last = np.nonzero(knots[:-1] < knots[1:])[0][-1]
+    N[t >= knots[last + 1], last] = 1.0
+    lower = N
+    for k in range(1, degree + 1):
+        lower = N
+        n = n_spans - k
+        d1 = knots[k:k + n] - knots[:n]
+        d2 = knots[k + 1:k + 1 + n] - knots[1:n + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(d1 > 0, (tt - knots[:n]) / d1, 0.0)
+            b = np.where(d2 > 0, (knots[k + 1:k + 1 + n] - tt) / d2, 0.0)
+        N = a * lower[:, :n] + b * lower[:, 1:n + 1]
+    if degree == 0:
+        return N, np.zeros_like(N)
+    n = N.shape[1]
+    d1 = knots[degree:degree + n] - knots[:n]
+    d2 = knots[degree + 1:degree + 1 + n] - knots[1:n + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(d1 > 0, degree / d1, 0.0)
+        b = np.where(d2 > 0, degree / d2, 0.0)
+    dN = a * lower[:, :n] - b * lower[:, 1:n + 1]
+    return N, dN
+
+
+def bspline_normal_z(poles, weights, u_knots, v_knots, u_degree, v_degree,
+                     us, vs):
+    """Vertical component of the unit normal of a B-spline surface.
+
+    poles has shape (n_u, n_v, 3) and weights (n_u, n_v).  Knots are the full
+    (flat) knot vectors.  us and vs are equal length arrays of parameters.
+    Returns the absolute vertical components, which are NaN wherever the
+    normal is undefined.
+
+    """
+    Nu, dNu = _basis(u_knots, u_degree, np.asarray(us, dtype=float))
+    Nv, dNv = _basis(v_knots, v_degree, np.asarray(vs, dtype=float))
+    wp = poles * weights[:, :, np.newaxis]
+
+    def combine(bu, bv):
+        point = np.einsum('ki,ijc,kj->kc', bu, wp, bv)
+        weight = np.einsum('ki,ij,kj->k', bu, weights, bv)
+        return point, weight
+
+    A, w = combine(Nu, Nv)
+    A_u, w_u = combine(dNu, Nv)
+    A_v, w_v = combine(Nu, dNv)
+    S = A / w[:, np.newaxis]
+    S_u = (A_u - w_u[:, np.newaxis] * S) / w[:, np.newaxis]
+    S_v = (A_v - w_v[:, np.newaxis] * S) / w[:, np.newaxis]
+    normal = np.cross(S_u, S_v)
+    length = np.sqrt((normal ** 2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(length > 0, np.abs(normal[:, 2]) / length, np.nan)
+
+
+class NormalSampler(object):
+    """Batched evaluation of the vertical component of a face's normals.
+
+    evaluations counts the OCC normalAt calls made so far.
+
+    """
+
+    def __init__(self, face):
+        self.face = face
+        self.evaluations = 0
+        surface = face.Surface
+        # Whether self._evaluate gives the same results as OCC would.
+        self._exact = True
+        self._evaluate = self._evaluate_points
+        if isinstance(surface, Part.BSplineSurface):
+            if not (surface.isUPeriodic() or surface.isVPeriodic()):
+                self._setup_bspline(surface)
+                self._evaluate = self._evaluate_bspline
+                self._exact = False
+        elif isinstance(surface, Part.SurfaceOfExtrusion):
+            self._evaluate = self._evaluate_extrusion
+            direction = surface.Direction
+            # The normal of an extrusion is at right angles to the extrusion
+            # direction, so a vertical extrusion has only horizontal normals.
+            if (direction.x, direction.y) == (0, 0):
+                self._evaluate = self._evaluate_vertical_extrusion
+
+    def _setup_bspline(self, surface):
+        self._poles = np.array(
+            [[(p.x, p.y, p.z) for p in row] for row in surface.getPoles()])
+        weights = surface.getWeights()
+        self._weights = (np.array(weights, dtype=float) if weights
+                         else np.ones(self._poles.shape[:2]))
+        self._u_knots = _flat_knots(surface.getUKnots(),
+                                    surface.getUMultiplicities())
+        self._v_knots = _flat_knots(surface.getVKnots(),
+                                    surface.getVMultiplicities())
+        self._u_degree = surface.UDegree
+        self._v_degree = surface.VDegree
+
+    def normal_z(self, u, v):
+        "Absolute vertical normal component at one point, as given by OCC."
+        self.evaluations += 1
+        return abs(self.face.normalAt(u, v).z)
+
+    def _evaluate_points(self, us, vs):
+        return np.array([self.normal_z(u, v) for u, v in zip(us, vs)])
+
+    def _evaluate_bspline(self, us, vs):
+        return bspline_normal_z(
+            self._poles, self._weights, self._u_knots, self._v_knots,
+            self._u_degree, self._v_degree, us, vs)
+
+    def _evaluate_extrusion(self, us, vs):
+        unique_us, inverse = np.unique(us, return_inverse=True)
+        v = vs[0] if len(vs) else 0
+        return self._evaluate_points(unique_us, [v] * len(unique_us))[inverse]
+
+    def _evaluate_vertical_extrusion(self, us, vs):
+        return np.zeros(len(us))
+
+    def has_vertical_component(self, us, vs, tol):
+        """Check if the normal at any of the given points is not horizontal.
+
+        Points are evaluated in one batch.  Where the batched result is too
+        close to tol to be trusted, the point is rechecked with OCC.  Returns
+        (found, near), where near is a boolean array marking points that were
+        close to tol but passed.
+
+        """
+        us = np.asarray(us, dtype=float)
+        vs = np.asarray(vs, dtype=float)
+        nz = self._evaluate(us, vs)
+        if self._exact:
+            if (nz >= tol).any():
+                return True, None
+            return False, nz >= tol / NEAR_FACTOR
+        uncertain = np.isnan(nz)
+        if (nz[~uncertain] >= tol * NEAR_FACTOR).any():
+            return True, None
+        near = uncertain | (nz >= tol / NEAR_FACTOR)
+        for k in np.nonzero(near)[0]:
+            if self.normal_z(us[k], vs[k]) >= tol:
+                return True, None
+        return False, near
+
+
+def has_vertical_normals(face, n_points=20, refine=1, tol=1e-13,
+                         sampler=None):
+    """Check whether a face has any normals with a vertical component.
+
+    Normals are sampled on an n_points by n_points grid over the face's
+    parameter range, coarsest first, stopping as soon as one is found.  Grid
+    cells next to a point whose vertical component is near tol are then split
+    in half, up to refine times, to look more closely there.
+
+    """
+    if sampler is None:
+        sampler = NormalSampler(face)
+    u1, u2, v1, v2 = face.ParameterRange
+    du = (u2 - u1) / n_points
+    dv = (v2 - v1) / n_points
+    near_points = []
+    for level in grid_levels(n_points):
+        us = u1 + du * level[:, 0]
+        vs = v1 + dv * level[:, 1]
+        found, near = sampler.has_vertical_component(us, vs, tol)
+        if found:
+            return True
+        near_points.extend(zip(us[near], vs[near]))
+
+    # Look more closely around the suspicious points, with each round using
+    # cells half the size of the previous round.
+    for _ in range(refine):
+        if not near_points:
+            break
+        du /= 2
+        dv /= 2
+        offsets = [(a * du, b * dv) for a in (-1, 0, 1) for b in (-1, 0, 1)
+                   if (a, b) != (0, 0)]
+        candidates = set()
+        for u, v in near_points:
+            for ou, ov in offsets:
+                if u1 <= u + ou <= u2 and v1 <= v + ov <= v2:
+                    candidates.add((u + ou, v + ov))
+        if not candidates:
+            break
+        us, vs = np.array(sorted(candidates)).T
+        found, near = sampler.has_vertical_component(us, vs, tol)
+        if found:
+            return True
+        near_points = list(zip(us[near], vs[near]))
+    return False
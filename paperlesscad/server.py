@@ -0,0 +1,190 @@
+"""Long-running local server that keeps warm FreeCAD workers for dfm_check.
+
+Start it with:
+
+    python -m paperlesscad.server --port 8765 --workers 4
+
+Then POST a JSON object to /check with the path of a STEP file on this
+machine, and optionally a kerf width:
+
+    {"path": "/tmp/upload.step", "kerf_width": 1.5}
+
+The response is a JSON object with either a "result" (the same as returned by
+dfm_check) or an "error".  GET /stats returns counts of jobs handled.
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import threading
+from multiprocessing import cpu_count
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from paperlesscad.workers import Worker
+
+
+class CheckServer(ThreadingMixIn, HTTPServer):
+    """HTTP server passing each request on to a set of worker processes.
+
+    Each request is handled in its own thread, which waits for a worker to
+    finish the job.  At most workers + max_queued jobs are accepted at once;
+    any more are refused with a 503 status so that callers can back off.
+    Workers are replaced after max_jobs_per_worker jobs, to contain memory
+    growth within OCC.  A job that takes longer than timeout seconds, or
+    crashes its worker, gets a 500 status, and the worker is replaced.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_queued=64,
+                 max_jobs_per_worker=100, cache=None, timeout=300):
+        workers = workers or cpu_count()
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.cache = cache
+        self.job_timeout = timeout
+        # Start the workers before opening the socket, so that they do not
+        # inherit it.
+        self.idle = Queue()
+        self.live = set()
+        self.live_lock = threading.Lock()
+        self.closing = False
+        for _ in range(workers):
+            self.idle.put(self._start_worker())
+        HTTPServer.__init__(self, address, CheckRequestHandler)
+        self.slots = threading.BoundedSemaphore(workers + max_queued)
+        self.stats_lock = threading.Lock()
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _start_worker(self):
+        "Start a worker, unless the server is closing.  Returns the worker."
+        with self.live_lock:
+            if self.closing:
+                return None
+            worker = Worker(self.cache)
+            self.live.add(worker)
+        return worker
+
+    def check(self, step_path, kerf_width=None):
+        """Run one job on the next free worker, waiting for it to finish.
+
+        Returns (result, error) as for paperlesscad.batch.check_many, or None
+        if the queue is full.
+
+        """
+        if not self.slots.acquire(False):
+            self.count('rejected')
+            return None
+        try:
+            worker = self.idle.get()
+            try:
+                result, error = worker.check(step_path, self.job_timeout,
+                                             kerf_width=kerf_width)
+            finally:
+                if worker.alive and worker.jobs >= self.max_jobs_per_worker:
+                    worker.stop()
+                if not worker.alive:
+                    with self.live_lock:
+                        self.live.discard(worker)
+                    worker = self._start_worker()
+                if worker is not None:
+                    self.idle.put(worker)
+        finally:
+            self.slots.release()
+        self.count('completed' if error is None else 'failed')
+        return result, error
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        with self.live_lock:
+            self.closing = True
+            workers = list(self.live)
+            self.live.clear()
+        for worker in workers:
+            worker.kill()
+
+
+class CheckRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        with self.server.stats_lock:
+            self.send_json(200, dict(self.server.stats))
+
+    def do_POST(self):
+        if self.path != '/check':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            step_path = request['path']
+            kerf_width = request.get('kerf_width')
+            if kerf_width is not None:
+                kerf_width = float(kerf_width)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_json(400, {'error': 'Expected a JSON object with a '
+                                          '"path" and optional "kerf_width"'})
+            return
+        outcome = self.server.check(step_path, kerf_width)
+        if outcome is None:
+            self.send_json(503, {'error': 'Too many queued jobs'})
+            return
+        result, error = outcome
+        if error is None:
+            self.send_json(200, {'result': result})
+        else:
+            self.send_json(500, {'error': error})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--max-queued', type=int, default=64,
+                        help='jobs to queue beyond those being worked on')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=100,
+                        help='jobs before a worker process is replaced')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds to allow for each job (default: 300)')
+    args = parser.parse_args(argv)
+    server = CheckServer((args.host, args.port), args.workers,
+                         args.max_queued, args.max_jobs_per_worker,
+                         timeout=args.timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -9,10 +9,22 @@ available via `pip`, please include installation instructions.
 
 from __future__ import absolute_import, division, print_function
 
-from itertools import chain, combinations, product
+import time
+from itertools import chain
 from math import pi
+from multiprocessing import Pool
 
-from paperlesscad.utils import is_close, HashShape, is_concave
+import numpy as np
+
+from paperlesscad import prescan
+from paperlesscad.cache import file_digest
+from paperlesscad.incremental import face_fingerprint
+from paperlesscad.instrument import Instrumentation, NullInstrumentation
+from paperlesscad.outline import extract_profile
+from paperlesscad.sampling import has_vertical_normals, NormalSampler
+from paperlesscad.spatial import AxisIndex, BoxTree, box_of
+from paperlesscad.tessellation import sample_face
+from paperlesscad.utils import FaceInfo, is_close, is_vertical, Topology
 
 import FreeCAD
 import Part
@@ -22,129 +34,680 @@ import Part
 # If left as None, a kerf width will be set automatically below.
 kerf_width_override = None
 
+# If desired, a paperlesscad.cache.ResultCache can be set here to reuse results
+# for files that have been checked before.
+result_cache = None
+
+# If desired, a paperlesscad.cache.GeometryCache can be set here to load parts
+# that have been seen before without parsing their STEP files again.
+geometry_cache = None
+
+# If desired, a function can be set here to receive timings and counters from
+# every call to dfm_check.  It is called as metrics_hook(step_path, metrics).
+metrics_hook = None
+
+# Version of the checks, used to tell apart cached results.  Change this
+# whenever the checks are changed in a way that could change their results.
+DETECTOR_VERSION = '1'
 
-def dfm_check(step_path):
+
+def dfm_check(step_path, kerf_width=None, cache=None, axes=False,
+              normal_grid=20, normal_refine=1, instrument=False, hook=None,
+              issue_types=None, state=None, budget=None, processes=None,
+              geometry=None, mid_phase=False, progress=None):
     """Place your solution in this function. Create and call other functions, 
-    classes, modules, and packages as required."""
-    shape = Part.Shape()
-    shape.read(step_path)
-    issues = []
+    classes, modules, and packages as required.
+
+    A kerf_width given here takes the place of kerf_width_override above for
+    this call only.  If a ResultCache is given (or set as result_cache above),
+    results are looked up by the file's contents before doing any work, and
+    stored there afterwards.
+
+    If axes is True, the result also has an 'axes' list, giving each group of
+    vertical cylinders and cones that share an axis as {'center': [x, y],
+    'faces': [...]}.  It is None instead if a time budget ran out before the
+    axes could be found.
+
+    Freeform faces are checked for vertical walls by sampling their normals on
+    a normal_grid by normal_grid grid, then looking more closely, up to
+    normal_refine times, anywhere that the result was borderline.
+
+    If instrument is True, the result also has a 'metrics' dict, holding the
+    wall time of each phase of the checks under 'timings' and counts of the
+    work done under 'counters'.  If a hook is given (or set as metrics_hook
+    above), it is called with the same metrics as hook(step_path, metrics).
+
+    If issue_types is given, only those types of issues are reported, and only
+    the checks needed to find them are run.  A part that is well outside the
+    problem space is still reported as 'non-uniform', since none of the other
+    checks apply to it.
+
+    If an incremental.IncrementalState is given, the results of the most
+    expensive checks on each face and pair of faces are looked up there before
+    being worked out, and stored there afterwards.  Checking a revised part
+    with the state left from checking the original then only repeats that work
+    for the faces that changed.
+
+    If a time budget in seconds is given, checks are not started once it has
+    run out, and the long running ones stop part way through.  The issues
+    found so far are returned, along with a 'skipped' list naming the checks
+    that were not run and a 'partial' list naming those that did not finish.
+    Results that are incomplete are not cached.
+
+    If processes is given, the face pairs for the small cut check are shared
+    out among that many worker processes.  That is only worth it for large
+    parts, and cannot be used from within a daemonic worker process, such as
+    those of batch.check_many.
+
+    If a GeometryCache is given (or set as geometry_cache above), the part is
+    loaded from there if it has been seen before, and stored there otherwise.
+
+    If mid_phase is True, the small cut check samples points from the faces
+    that it compares, and settles the pairs that are clearly apart or clearly
+    too close from those, leaving only the rest to OCC.  That pays off for
+    parts with many curved walls near each other.
+
+    If progress is given, it is called as progress(name) as each check that is
+    run finishes, with the name of the check.
+
+    """
+    deadline = None if budget is None else time.time() + budget
+    if kerf_width is None:
+        kerf_width = kerf_width_override
+    if cache is None:
+        cache = result_cache
+    if hook is None:
+        hook = metrics_hook
+    if geometry is None:
+        geometry = geometry_cache
+    if instrument or hook is not None:
+        instr = Instrumentation()
+    else:
+        instr = NullInstrumentation()
+    sampling = (normal_grid, normal_refine)
+    if state is not None and state.version != DETECTOR_VERSION:
+        state.reset(DETECTOR_VERSION)
+    if issue_types is not None:
+        issue_types = frozenset(issue_types)
+        unknown = issue_types - known_issue_types()
+        if unknown:
+            raise ValueError(
+                'Unknown issue types: ' + ', '.join(sorted(unknown)))
+
+    incomplete = {'skipped': [], 'partial': []}
+    if cache is None:
+        result, incomplete = _run(step_path, kerf_width, axes, sampling,
+                                  issue_types, state, deadline, processes,
+                                  geometry, mid_phase, progress, instr)
+    else:
+        instr.begin('cache')
+        options = ['axes'] if axes else []
+        options.append('normals={}x{}'.format(*sampling))
+        if issue_types is not None:
+            options.append('issues=' + ','.join(sorted(issue_types)))
+        if mid_phase:
+            options.append('mid_phase')
+        key = cache.key(file_digest(step_path), kerf_width, DETECTOR_VERSION,
+                        options)
+        result = cache.get(key)
+        if result is None:
+            instr.count('cache_misses')
+            result, incomplete = _run(step_path, kerf_width, axes, sampling,
+                                      issue_types, state, deadline, processes,
+                                      geometry, mid_phase, progress, instr)
+            instr.begin('cache')
+            if not (incomplete['skipped'] or incomplete['partial']):
+                cache.put(key, result)
+        else:
+            instr.count('cache_hits')
+    instr.end()
+
+    if budget is not None:
+        result = dict(result, **incomplete)
+    if isinstance(instr, Instrumentation):
+        metrics = instr.as_dict()
+        if instrument:
+            result = dict(result, metrics=metrics)
+        if hook is not None:
+            hook(step_path, metrics)
+    return result
+
+
+def _run(step_path, kerf_width, axes, sampling, issue_types, state, deadline,
+         processes, geometry, mid_phase, progress, instr):
+    """Run the checks needed and put together the requested result.
+
+    Returns (result, incomplete), where incomplete lists the names of the
+    checks that were skipped or only partly run, for lack of time, under
+    'skipped' and 'partial'.
+
+    """
+    incomplete = {'skipped': [], 'partial': []}
+    # Parts with spheres or tori are "non-uniform" whatever else they have, and
+    # can be found from the file's text alone.  Loading the part is still
+    # needed to find its axes.
+    instr.begin('prescan')
+    if (not axes and prescan.mentions(step_path, prescan.BAD_SURFACES)
+            and prescan.scan(step_path).non_uniform):
+        instr.count('prescan_rejected')
+        result = {'issues': [{'issue': 'non-uniform', 'faces': None}]}
+        return result, incomplete
+
+    shape, topology = _load(step_path, geometry, instr)
 
     # Default kerf width is set as the part thickness, to a minimum of 0.125".
-    kerf_width = kerf_width_override
     if kerf_width is None:
         kerf_width = max(3.175, shape.BoundBox.ZLength)
 
-    # Break out sets of surfaces for later evaluation.
-    faces = shape.Faces
-    planes = set(f for f in faces if isinstance(f.Surface, Part.Plane))
-    horizontal_planes = set(
-        p for p in planes
-        if (is_close(p.Surface.Axis.x, 0) and is_close(p.Surface.Axis.y, 0)
-            and is_close(abs(p.Surface.Axis.z), 1)))
-    angled_planes = set(
-        p for p in (planes - horizontal_planes)
-        if not is_close(p.Surface.Axis.z, 0))
-    cylinders = set(f for f in faces if isinstance(f.Surface, Part.Cylinder))
-    vertical_cylinders = set(
-        c for c in cylinders
-        if (is_close(c.Surface.Axis.x, 0) and is_close(c.Surface.Axis.y, 0)
-            and is_close(abs(c.Surface.Axis.z), 1)))
-    cones = set(f for f in faces if isinstance(f.Surface, Part.Cone))
-    vertical_cones = set(
-        c for c in cones
-        if (is_close(c.Surface.Axis.x, 0) and is_close(c.Surface.Axis.y, 0)
-            and is_close(abs(c.Surface.Axis.z), 1)))
+    # Checks are run cheapest first, so that as many as possible get done
+    # within a time budget, but their issues are listed in the order that the
+    # checks are registered.
+    analysis = Analysis(shape, kerf_width, sampling, state, deadline, instr,
+                        topology)
+    analysis.processes = processes
+    analysis.mid_phase = mid_phase
+    found = {}
+    _run_checks(analysis, run_order(plan_checks(
+        issue_types, ['surfaces'] if axes else [])), found, incomplete,
+        progress)
+
+    issues = _in_order(found)
+    if issue_types is not None and not analysis.stopped:
+        issues = [i for i in issues if i['issue'] in issue_types]
+    result = {'issues': issues}
+    if axes:
+        # Not known if the surfaces check was skipped for lack of time.
+        result['axes'] = analysis.details.get('axes')
+    return result, incomplete
+
+
+def _load(step_path, geometry, instr):
+    """Load a part, returning (shape, topology).
+
+    If geometry is a GeometryCache, the part is loaded from there if possible,
+    and stored there otherwise.
+
+    """
+    instr.begin('load')
+    if geometry is not None:
+        key = geometry.key(file_digest(step_path))
+        entry = geometry.get(key)
+        if entry is not None:
+            instr.count('geometry_cache_hits')
+            shape, face_edges = entry
+            instr.begin('topology')
+            return shape, Topology(shape, face_edges)
+        instr.count('geometry_cache_misses')
+    shape = Part.Shape()
+    shape.read(step_path)
+    instr.begin('topology')
+    topology = Topology(shape)
+    if geometry is not None:
+        instr.begin('load')
+        geometry.put(key, shape, topology)
+    return shape, topology
+
+
+def _run_checks(analysis, checks, found, incomplete, progress=None):
+    """Run checks in the order given, until one stops the analysis.
+
+    The issues found by each check are put in the found dict under its name.
+    Checks that run out of time are added to incomplete.  progress, if given,
+    is called with the name of each check after it has run.
+
+    """
+    for c in checks:
+        if analysis.time_up():
+            incomplete['skipped'].append(c.name)
+            continue
+        start = len(analysis.issues)
+        analysis.instr.begin(c.name)
+        analysis.cut_short = False
+        c.func(analysis)
+        found[c.name] = analysis.issues[start:]
+        if analysis.cut_short:
+            incomplete['partial'].append(c.name)
+        if progress is not None:
+            progress(c.name)
+        if analysis.stopped:
+            break
+
+
+def _in_order(found):
+    "List the issues found by each check, in the order checks are registered."
+    return [i for c in CHECKS for i in found.get(c.name, ())]
+
+
+def dfm_sweep(step_path, kerf_widths, normal_grid=20, normal_refine=1,
+              geometry=None):
+    """Check a part for each of several kerf widths, in one pass.
+
+    Gives the same issues for each kerf width as dfm_check would, but loads
+    the part and runs the checks that do not depend on the kerf width only
+    once.  Face pair distances for the small cut check are measured once and
+    then compared against each kerf width.  A kerf width of None is derived
+    from the part as in dfm_check.
+
+    Returns {'results': [...], 'thresholds': [...]}.  results holds
+    {'kerf_width': ..., 'issues': [...]} for each kerf width, in the order
+    given.  thresholds lists every small-hole and small-cut issue found for
+    any kerf width, with the kerf width at which it starts to appear, as
+    {'issue': ..., 'faces': [...], 'kerf_width': ...}.  A small cut appears at
+    kerf widths from its threshold up, as its faces are then no further apart
+    than the kerf width.  A small hole only appears at kerf widths above its
+    threshold, which is its diameter.  A small cut can be hidden again at
+    larger kerf widths, once the corner next to it is also too tight.
+
+    A GeometryCache can be given, or set as geometry_cache above, as for
+    dfm_check.  With no kerf widths, both lists are empty and the part is not
+    loaded.
+
+    """
+    kerf_widths = list(kerf_widths)
+    if not kerf_widths:
+        return {'results': [], 'thresholds': []}
+    if geometry is None:
+        geometry = geometry_cache
+    instr = NullInstrumentation()
+    shape, topology = _load(step_path, geometry, instr)
+    auto_kerf_width = max(3.175, shape.BoundBox.ZLength)
+    kerf_widths = [auto_kerf_width if k is None else k for k in kerf_widths]
+
+    analysis = Analysis(shape, max(kerf_widths), (normal_grid, normal_refine),
+                        None, None, instr, topology)
+    analysis.measured = {}
+    checks = run_order(CHECKS)
+    found = {}
+    incomplete = {'skipped': [], 'partial': []}
+    _run_checks(analysis, [c for c in checks if not c.uses_kerf], found,
+                incomplete)
+    if not analysis.stopped:
+        # One outline, at the finest deflection needed, serves every kerf
+        # width.
+        analysis.profile = extract_profile(
+            analysis, PROFILE_DEFLECTION * min(kerf_widths))
+
+    results = []
+    thresholds = {}
+    for kerf_width in kerf_widths:
+        kerf_found = dict(found)
+        if not analysis.stopped:
+            analysis.kerf_width = kerf_width
+            _run_checks(analysis, [c for c in checks if c.uses_kerf],
+                        kerf_found, incomplete)
+        issues = _in_order(kerf_found)
+        results.append({'kerf_width': kerf_width, 'issues': issues})
+        for issue in issues:
+            faces = issue['faces']
+            if issue['issue'] == 'small-hole':
+                threshold = 2 * analysis.face_info[faces[0]].radius
+            elif issue['issue'] == 'small-cut':
+                threshold = _measure_exactly(analysis, *faces)[0]
+            else:
+                continue
+            thresholds[(issue['issue'], tuple(faces))] = threshold
+    return {'results': results,
+            'thresholds': [{'issue': issue, 'faces': list(faces),
+                            'kerf_width': thresholds[(issue, faces)]}
+                           for issue, faces in sorted(thresholds)]}
+
+
+class Analysis(object):
+    """State shared between the checks during one run on a part.
+
+    Each check reads the attributes set by the checks that it requires, and
+    sets its own for the checks that come after.  Issues found are appended to
+    the issues list.  If a check finds that the part is well outside our
+    problem space, it sets stopped, and no further checks are run.  Other
+    information found along the way is added to the details dict, and the work
+    done is recorded with instr.  Checks may reuse results kept in state, an
+    IncrementalState, unless it is None.
+
+    Checks that can take a long time should call time_up now and then, and
+    return straight away if it is True.  cut_short records that this happened.
+
+    If processes is set, checks may spread their work over that many worker
+    processes.  If mid_phase is set, the small cut check bounds distances from
+    points sampled from the faces, which are kept in samples.  If measured is
+    a dict rather than None, the same analysis is used for more than one kerf
+    width, and measurements of face pairs that do not depend on the kerf width
+    are kept there, with the part's outline.Profile, if any, in profile.
+
+    """
+
+    def __init__(self, shape, kerf_width, sampling, state, deadline, instr,
+                 topology=None):
+        self.shape = shape
+        self.kerf_width = kerf_width
+        self.sampling = sampling
+        self.state = state
+        self.deadline = deadline
+        self.instr = instr
+        self.issues = []
+        self.details = {}
+        self.stopped = False
+        self.cut_short = False
+        self.measured = None
+        self.profile = None
+        self.processes = None
+        self.mid_phase = False
+        self.samples = {}
+        self._fingerprints = {}
+
+        # Find which faces and edges connect to each other, unless already
+        # known.  Faces and edges are referred to by their index in
+        # shape.Faces and shape.Edges from here on.
+        if topology is None:
+            instr.begin('topology')
+            topology = Topology(shape)
+        self.topology = topology
+        self.faces = self.topology.faces
+        self.edges = self.topology.edges
+        self.face_info = [FaceInfo(f) for f in self.faces]
+        instr.count('edges', len(self.edges))
+
+    def time_up(self):
+        "Check whether the time budget, if any, has run out."
+        if self.deadline is not None and time.time() > self.deadline:
+            self.cut_short = True
+        return self.cut_short
+
+    def fingerprint(self, i):
+        "Fingerprint of face i, as given by incremental.face_fingerprint."
+        if i not in self._fingerprints:
+            self._fingerprints[i] = face_fingerprint(self.faces[i])
+        return self._fingerprints[i]
+
+    def recall(self, key, func, *args):
+        """Look up a result in state, or work it out as func(*args).
+
+        Results that are worked out are stored in state for next time.
+
+        """
+        result = self.state.get(key)
+        if result is None:
+            self.instr.count('incremental_misses')
+            result = func(*args)
+            self.state.put(key, result)
+        else:
+            self.instr.count('incremental_hits')
+        return result
+
+
+class Check(object):
+    "A check on a part, as registered with the check decorator."
+
+    def __init__(self, name, func, issues, requires, cost, uses_kerf):
+        self.name = name
+        self.func = func
+        self.issues = issues
+        self.requires = requires
+        self.cost = cost
+        self.uses_kerf = uses_kerf
+
+
+# All registered checks, in the order that they report their issues.
+CHECKS = []
+
+
+def check(name, issues=(), requires=(), cost=1, uses_kerf=False):
+    """Decorator to register a function as a check.
+
+    The function is called with an Analysis.  issues lists the issue types
+    that the check can report, and requires names the checks whose findings it
+    uses.  Checks must be registered after all the checks that they require.
+    Checks report their issues in the order they are registered.  cost is a
+    rough ranking of how long the check takes, used to run cheap checks first.
+    Checks whose results depend on the kerf width must say so with uses_kerf,
+    and only checks that do so can require them.
+
+    """
+    def register(func):
+        by_name = {c.name: c for c in CHECKS}
+        assert set(by_name).issuperset(requires), (
+            'Unknown requirements for ' + name)
+        assert uses_kerf or not any(by_name[r].uses_kerf for r in requires), (
+            'Requirements of {} use the kerf width'.format(name))
+        CHECKS.append(Check(name, func, tuple(issues), tuple(requires), cost,
+                            uses_kerf))
+        return func
+    return register
+
+
+def plan_checks(issue_types=None, names=()):
+    """List the checks needed to find the given issue types, in order.
+
+    All checks are needed if issue_types is None.  Checks can also be asked
+    for by name.  Every check required by a needed check is also needed.
+
+    """
+    if issue_types is None:
+        return list(CHECKS)
+    by_name = {c.name: c for c in CHECKS}
+    needed = set()
+    stack = list(names)
+    stack.extend(c.name for c in CHECKS
+                 if not set(c.issues).isdisjoint(issue_types))
+    while stack:
+        name = stack.pop()
+        if name not in needed:
+            needed.add(name)
+            stack.extend(by_name[name].requires)
+    return [c for c in CHECKS if c.name in needed]
+
+
+def run_order(checks):
+    """Order checks to run cheapest first.
+
+    Each check still comes after all of the checks that it requires, and ties
+    are broken by the order the checks were given in.
+
+    """
+    pending = list(checks)
+    names = set(c.name for c in pending)
+    done = set()
+    order = []
+    while pending:
+        ready = [c for c in pending
+                 if done.issuperset(r for r in c.requires if r in names)]
+        c = min(ready, key=lambda c: c.cost)
+        pending.remove(c)
+        done.add(c.name)
+        order.append(c)
+    return order
+
+
+def known_issue_types():
+    "Set of all issue types that the checks can report."
+    return set(chain.from_iterable(c.issues for c in CHECKS))
+
+
+# The difference between "tight-corner" and "tight-corner-mild" is defined
+# here as being ten degrees.
+SHALLOW_LIMIT = 10 * pi/180
+
+# Parts that are a flat profile extruded straight up have their wall outlines
+# approximated by polylines that stay within this fraction of the kerf width
+# of the true edges.
+PROFILE_DEFLECTION = 1e-3
+
+# For the small cut mid-phase, faces are sampled with points no further apart
+# than MID_PHASE_SPACING times the kerf width, from a tessellation within
+# MID_PHASE_DEFLECTION times the kerf width of the face.  Faces that would
+# need more than MID_PHASE_MAX_POINTS points are left to OCC.
+MID_PHASE_SPACING = 0.25
+MID_PHASE_DEFLECTION = 0.01
+MID_PHASE_MAX_POINTS = 50000
+
+
+@check('surfaces', issues=['non-uniform'])
+def check_surfaces(a):
+    """Break out sets of surfaces for later evaluation.
+
+    Start by checking for things that are well outside our problem space.  If
+    a part does not have top and bottom planes or if it has any known-bad
+    surface types, then the rest of the code does not apply.  Just call it
+    "non-uniform" and quit.
+
+    """
+    info = a.face_info
+    a.all_faces = all_faces = set(range(len(info)))
+    a.planes = planes = set(i for i in all_faces if info[i].kind == 'plane')
+    a.horizontal_planes = set(p for p in planes if is_vertical(info[p].axis))
+    a.angled_planes = set(
+        p for p in (planes - a.horizontal_planes)
+        if not is_close(info[p].axis.z, 0))
+    a.cylinders = cylinders = set(
+        i for i in all_faces if info[i].kind == 'cylinder')
+    a.vertical_cylinders = set(
+        c for c in cylinders if is_vertical(info[c].axis))
+    a.cones = cones = set(i for i in all_faces if info[i].kind == 'cone')
+    a.vertical_cones = set(c for c in cones if is_vertical(info[c].axis))
     bad_surfaces = set(
-        f for f in faces
-        if isinstance(f.Surface, (Part.Sphere, Part.Toroid)))
-    leftovers = set(faces) - planes - cylinders - cones - bad_surfaces
-
-    # Construct map of which faces are connected to a given edge.
-    # There is usually two faces per edge, but sometimes only one.  I don't
-    # think that more than two is possible, but let's not assume.
-    # NOTE FreeCAD 0.17 will have an "ancestorsOfType" method that could
-    # simplify or replace this code.  See FreeCAD commit f9bfd775.
-    edge_to_faces = {HashShape(e): set() for e in shape.Edges}
-    for f in faces:
-        for e in f.Edges:
-            edge_to_faces[HashShape(e)].add(HashShape(f))
-
-    # Construct map of which faces are adjacent to a given face (i.e. all faces
-    # that share an edge with this face).
-    face_to_faces = {HashShape(f): set() for f in faces}
-    for f in faces:
-        for e in f.Edges:
-            face_to_faces[HashShape(f)].update(edge_to_faces[HashShape(e)])
-    for k, v in face_to_faces.iteritems():
-        # Don't consider a face as connected to itself.
-        v.remove(k)
-
-    # Start by checking for things that are well outside our problem space.  If
-    # a part does not have top and bottom planes or if it has any known-bad
-    # surface types, then the rest of the code does not apply.  Just call it
-    # "non-uniform" and quit.
-    if len(horizontal_planes) < 2 or bad_surfaces:
-        issues.append({'issue': 'non-uniform', 'faces': None})
-        return {'issues': issues}
-
-    # If there are any of the more unusual surfaces, use a heuristic to see if
-    # they're okay.  Put a grid of points over the surface and check the normal
-    # at each point; if all normals have no vertical component, then we can
-    # probably assume that the whole surface is like that.  In such a case, the
-    # surface should be cuttable; otherwise, it's definitely not.
-    # As above, if issues are found, then the rest of the code does not apply.
-    n_points = 20
-    for f in leftovers:
-        u1, u2, v1, v2 = f.ParameterRange
-        for a, b in product(range(n_points), repeat=2):
-            u = (u2 - u1) * a / n_points + u1
-            v = (v2 - v1) * b / n_points + v1
-            if not is_close(f.normalAt(u, v).z, 0):
-                issues.append({'issue': 'non-uniform', 'faces': None})
-                return {'issues': issues}
-
-    # Check for any cylinders or cones that are not vertical.  These will be
-    # considered as radiused edges.
-    # NOTE This could also correspond to a bunch of other geometric issues, but
-    # none of those are being checked for here, so just call them all "radius".
-    if (cylinders - vertical_cylinders) or (cones - vertical_cones):
-        issues.append({'issue': 'radius', 'faces': None})
-
-    # Check for sharp internal corners.  Look for vertical edges, then evaluate
-    # the attached faces to see if they meet at a significant angle, and
-    # whether they form a convex or concave corner.
-    # NOTE This will not work for an edge that's connected to only one face.
-    # If that face connects to itself with a sharp angle, this code will not
-    # detect that properly.  An edge connected to more than two faces is also
-    # ignored because I don't know what that would look like.
-    # The difference between "tight-corner" and "tight-corner-mild" is defined
-    # here as being ten degrees.
-    shallow_limit = 10 * pi/180
-    for e, fs in edge_to_faces.iteritems():
+        i for i in all_faces if info[i].kind in ('sphere', 'torus'))
+    a.leftovers = all_faces - planes - cylinders - cones - bad_surfaces
+    a.instr.count('faces_plane', len(planes))
+    a.instr.count('faces_cylinder', len(cylinders))
+    a.instr.count('faces_cone', len(cones))
+    a.instr.count('faces_sphere_or_torus', len(bad_surfaces))
+    a.instr.count('faces_other', len(a.leftovers))
+
+    # Index vertical cylinders and cones by the location of their axis, to
+    # quickly find those that are coaxial.
+    a.axis_index = AxisIndex()
+    for i in sorted(a.vertical_cylinders | a.vertical_cones):
+        center = info[i].center
+        a.axis_index.add(i, center.x, center.y)
+    a.details['axes'] = [
+        {'center': list(a.axis_index.locations[group[0]]), 'faces': group}
+        for group in a.axis_index.groups()]
+
+    if len(a.horizontal_planes) < 2 or bad_surfaces:
+        a.issues.append({'issue': 'non-uniform', 'faces': None})
+        a.stopped = True
+
+
+@check('freeform', issues=['non-uniform'], requires=['surfaces'], cost=3)
+def check_freeform(a):
+    """Check that any of the more unusual surfaces are vertical walls.
+
+    Use a heuristic to see if they're okay.  Put a grid of points over the
+    surface and check the normal at each point; if all normals have no
+    vertical component, then we can probably assume that the whole surface is
+    like that.  In such a case, the surface should be cuttable; otherwise, it's
+    definitely not.  As above, if issues are found, then the rest of the code
+    does not apply.
+
+    """
+    n_points, refine = a.sampling
+    for i in sorted(a.leftovers):
+        if a.time_up():
+            return
+        if a.state is None:
+            found = _has_vertical_normals(a, i)
+        else:
+            key = a.state.face_key('freeform', a.fingerprint(i), n_points,
+                                   refine)
+            found = a.recall(key, _has_vertical_normals, a, i)
+        if found:
+            a.issues.append({'issue': 'non-uniform', 'faces': None})
+            a.stopped = True
+            return
+
+
+def _has_vertical_normals(a, i):
+    n_points, refine = a.sampling
+    sampler = NormalSampler(a.faces[i])
+    found = has_vertical_normals(a.faces[i], n_points, refine,
+                                 sampler=sampler)
+    a.instr.count('normalAt_calls', sampler.evaluations)
+    return found
+
+
+@check('radius', issues=['radius'], requires=['freeform'])
+def check_radius(a):
+    """Check for any cylinders or cones that are not vertical.
+
+    These will be considered as radiused edges.
+
+    NOTE This could also correspond to a bunch of other geometric issues, but
+    none of those are being checked for here, so just call them all "radius".
+
+    """
+    if ((a.cylinders - a.vertical_cylinders)
+            or (a.cones - a.vertical_cones)):
+        a.issues.append({'issue': 'radius', 'faces': None})
+
+
+@check('sharp_corner', issues=['tight-corner', 'tight-corner-mild'],
+       requires=['freeform'], cost=2)
+def check_sharp_corner(a):
+    """Check for sharp internal corners.
+
+    Look for vertical edges, then evaluate the attached faces to see if they
+    meet at a significant angle, and whether they form a convex or concave
+    corner.  Each step works on all the remaining edges at once, so that the
+    more expensive steps are only done for the few edges that make it through.
+
+    NOTE This will not work for an edge that's connected to only one face.  If
+    that face connects to itself with a sharp angle, this code will not detect
+    that properly.  An edge connected to more than two faces is also ignored
+    because I don't know what that would look like.
+
+    """
+    # Gather the start and end points of every straight edge between two
+    # faces, to pick out the vertical ones all at once.
+    lines = []
+    points = []
+    for e, edge in enumerate(a.edges):
+        fs = a.topology.faces_of_edge(e)
         if len(fs) != 2:
             continue
-        fs = list(fs)
-        # Check if we have a vertical edge.
-        curve = e.Shape.Curve
+        curve = edge.Curve
         if not isinstance(curve, Part.Line):
             continue
-        edge_vec = curve.EndPoint - curve.StartPoint
-        if not (is_close(edge_vec.x, 0) and is_close(edge_vec.y, 0)):
-            continue
-        normals = []
-        # Calculate the normals of all surfaces meeting at that edge.
-        for f in fs:
-            params = f.Shape.Surface.parameter(curve.StartPoint)
-            normals.append(f.Shape.normalAt(*params))
-        # Compare angles between all normals.
-        # NOTE Found that tolerance on angles needed loosening so as to not
-        # give a spurious error for milled_pocket.STEP.  Should not be an issue
-        # since any angle that close to zero is definitely not a problem.
-        angle = normals[0].getAngle(normals[1])
-        if is_close(angle, 0, tol=1e-6):
-            continue
-        elif angle > shallow_limit:
+        start, end = curve.StartPoint, curve.EndPoint
+        lines.append((fs, start))
+        points.append(((start.x, start.y, start.z), (end.x, end.y, end.z)))
+    if not lines:
+        return
+    points = np.array(points)
+    edge_vecs = points[:, 1, :2] - points[:, 0, :2]
+    vertical = (np.abs(edge_vecs) < 1e-13).all(axis=1)
+    lines = [lines[k] for k in np.nonzero(vertical)[0]]
+    a.instr.count('vertical_edges', len(lines))
+
+    # Calculate the normals of both surfaces meeting at each vertical edge.
+    # A plane has the same normal everywhere, so only ask for it once.
+    plane_normals = {}
+    normals = np.empty((len(lines), 2, 3))
+    for k, (fs, start) in enumerate(lines):
+        if a.time_up():
+            return
+        for j, i in enumerate(fs):
+            if i in plane_normals:
+                n = plane_normals[i]
+            else:
+                n = a.faces[i].normalAt(
+                    *a.face_info[i].surface.parameter(start))
+                a.instr.count('normalAt_calls')
+                if i in a.planes:
+                    plane_normals[i] = n
+            normals[k, j] = (n.x, n.y, n.z)
+
+    # Compare angles between the normals, as Vector.getAngle would.
+    # NOTE Found that tolerance on angles needed loosening so as to not
+    # give a spurious error for milled_pocket.STEP.  Should not be an issue
+    # since any angle that close to zero is definitely not a problem.
+    lengths = np.sqrt((normals ** 2).sum(axis=2))
+    cosines = ((normals[:, 0] * normals[:, 1]).sum(axis=1)
+               / (lengths[:, 0] * lengths[:, 1]))
+    angles = np.arccos(np.clip(cosines, -1.0, 1.0))
+    for k in np.nonzero(angles >= 1e-6)[0]:
+        if a.time_up():
+            return
+        fs, start = lines[k]
+        if angles[k] > SHALLOW_LIMIT:
             possible_issue = {'issue': 'tight-corner', 'faces': None}
         else:
             possible_issue = {'issue': 'tight-corner-mild', 'faces': None}
@@ -153,176 +716,435 @@ def dfm_check(step_path):
         # of the average of the surface normals.  This point is then projected
         # onto each surface.  If the projected point is outside of the limits
         # of at least one surface, then it is an external (convex) corner.
-        test_point = ((normals[0] + normals[1]).normalize().multiply(0.001)
-                      + curve.StartPoint)
+        n0, n1 = (FreeCAD.Vector(*n) for n in normals[k])
+        test_point = (n0 + n1).normalize().multiply(0.001) + start
         # NOTE This is the rarely used for-else construct.  The else clause
         # will happen only if no break occurs in the for loop.  This therefore
         # checks that the test point is outside all connected surfaces.
-        for f in fs:
-            ut, vt = f.Shape.Surface.parameter(test_point)
-            u1, u2, v1, v2 = f.Shape.ParameterRange
+        for i in fs:
+            ut, vt = a.face_info[i].surface.parameter(test_point)
+            u1, u2, v1, v2 = a.face_info[i].parameter_range
             if not ((u1 <= ut <= u2) and (v1 <= vt <= v2)):
                 break
         else:
-            issues.append(possible_issue)
-
-    # Check for countersinks.  This will be anywhere that a cone and a cylinder
-    # have the same axis, are connected at an edge, and are both concave.
-    # Also track the cones involved here, since any that are not part of
-    # countersinks must instead be a draft or a chamfer.
-    countersink_cones = set()
-    for surfs in edge_to_faces.itervalues():
-        s = [surf.Shape for surf in surfs]
-        # Sometimes an edge connects to only one face.  Maybe it could connect
-        # to more than two faces.  Skip those cases.
-        if len(s) != 2:
-            continue
-        # Check if the surface pair is exactly one cone and one cylinder.
-        cone_cyl = ((s[0] in vertical_cones and s[1] in vertical_cylinders)
-                    or (s[1] in vertical_cones and s[0] in vertical_cylinders))
-        if not cone_cyl:
-            continue
-        # Check that both cone and cylinder are concave.
-        if not (is_concave(s[0]) and is_concave(s[1])):
-            continue
-        # Check that the axes of the cone and cylinder are aligned.
-        aligned = (is_close(s[0].Surface.Center.x, s[1].Surface.Center.x)
-                   and is_close(s[0].Surface.Center.y, s[1].Surface.Center.y))
-        if not aligned:
+            a.issues.append(possible_issue)
+
+
+@check('counter_sink', issues=['counter-sink'], requires=['freeform'])
+def check_counter_sink(a):
+    """Check for countersinks.
+
+    This will be anywhere that a cone and a cylinder have the same axis, are
+    connected at an edge, and are both concave.  Coaxial cylinders are looked
+    up for each cone from the axis index.
+
+    Also track the cones involved here, since any that are not part of
+    countersinks must instead be a draft or a chamfer.
+
+    """
+    info = a.face_info
+    topology = a.topology
+    a.countersink_cones = set()
+    for cone in sorted(a.vertical_cones):
+        cyls = a.vertical_cylinders.intersection(a.axis_index.coaxial(cone))
+        if not cyls or not info[cone].concave:
             continue
-        # If we've made it this far, then we can consider it a countersink.
-        issues.append({
-            'issue': 'counter-sink',
-            'faces': [faces.index(s[0]), faces.index(s[1])]})
-        countersink_cones.add(vertical_cones.intersection(s).pop())
-
-    # Check for counterbores.  This will be anywhere that two cylinders of
-    # different radii have the same axis and are connected with a horizontal
-    # plane.  In each horizontal plane, check all cylinders connected to it to
-    # see if they look like counterbores.
-    # Also track those connecting planes, since they are otherwise non-uniform.
-    counterbore_planes = set()
-    for p in horizontal_planes:
+        for cyl in sorted(cyls):
+            # Check that the cylinder is also concave.
+            if not info[cyl].concave:
+                continue
+            shared_edges = set(topology.edges_of_face(cone)).intersection(
+                topology.edges_of_face(cyl))
+            for e in sorted(shared_edges):
+                # Sometimes an edge connects to only one face.  Maybe it could
+                # connect to more than two faces.  Skip those cases.
+                if len(topology.faces_of_edge(e)) != 2:
+                    continue
+                # If we've made it this far, then we can consider it a
+                # countersink.
+                a.issues.append({'issue': 'counter-sink',
+                                 'faces': sorted([cone, cyl])})
+                a.countersink_cones.add(cone)
+
+
+@check('counter_bore', issues=['counter-bore'], requires=['freeform'])
+def check_counter_bore(a):
+    """Check for counterbores.
+
+    This will be anywhere that two cylinders of different radii have the same
+    axis and are connected with a horizontal plane.  In each horizontal plane,
+    check all cylinders connected to it to see if they look like counterbores,
+    comparing each only to the cylinders that share its axis.
+
+    Also track those connecting planes, since they are otherwise non-uniform.
+
+    """
+    info = a.face_info
+    a.counterbore_planes = set()
+    for p in sorted(a.horizontal_planes):
         # Get all concave vertical cylinders connected to this plane.
-        connected_faces = [f.Shape for f in face_to_faces[HashShape(p)]]
-        connected_cyls = vertical_cylinders.intersection(connected_faces)
-        concave_cyls = [c for c in connected_cyls if is_concave(c)]
+        connected_cyls = a.vertical_cylinders.intersection(
+            a.topology.adjacent_faces(p))
+        concave_cyls = set(c for c in connected_cyls if info[c].concave)
         # Compare these cylinders to each other in pairs.
-        for c1, c2 in combinations(concave_cyls, 2):
-            # If the cylinders have the same radii or the same vertical limits,
-            # then they probably can't be considered counterbores.
-            if is_close(c1.Surface.Radius, c2.Surface.Radius):
-                continue
-            if is_close(c1.BoundBox.ZMax, c2.BoundBox.ZMax):
-                continue
-            # If the cylinders do not align, then don't call them counterbores.
-            aligned = (is_close(c1.Surface.Center.x, c2.Surface.Center.x)
-                       and is_close(c1.Surface.Center.y, c2.Surface.Center.y))
-            if not aligned:
-                continue
-            issues.append({
-                'issue': 'counter-bore',
-                'faces': [faces.index(c1), faces.index(c2), faces.index(p)]})
-            counterbore_planes.add(p)
-
-    # Check for small holes and too-small corners.  These are cylinders with
-    # diameters less than the kerf width.  Small holes and tight corners are
-    # distinguished based on whether that cylinder connects to anything other
-    # than cylinders and cones.  Tight corners are further divided into mild
-    # and regular, as in the sharp corner code above.
-    # NOTE This must happen after counterbore checks just because of the way
-    # that test.py is currently configured.
-    min_radius = 0.5 * kerf_width
-    tight_corner_sets = []
-    for c in vertical_cylinders:
-        if not (c.Surface.Radius < min_radius and is_concave(c)):
+        for i1 in sorted(concave_cyls):
+            for i2 in a.axis_index.coaxial(i1):
+                if i2 <= i1 or i2 not in concave_cyls:
+                    continue
+                c1, c2 = info[i1], info[i2]
+                # If the cylinders have the same radii or the same vertical
+                # limits, then they probably can't be considered counterbores.
+                if is_close(c1.radius, c2.radius):
+                    continue
+                if is_close(c1.zmax, c2.zmax):
+                    continue
+                a.issues.append({'issue': 'counter-bore',
+                                 'faces': [i1, i2, p]})
+                a.counterbore_planes.add(p)
+
+
+@check('small_hole',
+       issues=['small-hole', 'tight-corner', 'tight-corner-mild'],
+       requires=['freeform'], uses_kerf=True)
+def check_small_hole(a):
+    """Check for small holes and too-small corners.
+
+    These are cylinders with diameters less than the kerf width.  Small holes
+    and tight corners are distinguished based on whether that cylinder
+    connects to anything other than cylinders and cones.  Tight corners are
+    further divided into mild and regular, as in the sharp corner check.
+
+    NOTE This is registered after the counterbore check just because of the
+    way that test.py is currently configured, which expects the issues in that
+    order.
+
+    """
+    min_radius = 0.5 * a.kerf_width
+    a.tight_corner_sets = []
+    for i in sorted(a.vertical_cylinders):
+        c = a.face_info[i]
+        if not (c.radius < min_radius and c.concave):
             continue
-        connected_fs = {f.Shape for f in face_to_faces[HashShape(c)]}
-        interesting_fs = connected_fs - horizontal_planes - cylinders - cones
+        connected_fs = set(a.topology.adjacent_faces(i))
+        interesting_fs = (connected_fs - a.horizontal_planes - a.cylinders
+                          - a.cones)
         if not interesting_fs:
-            issues.append({'issue': 'small-hole', 'faces': [faces.index(c)]})
+            a.issues.append({'issue': 'small-hole', 'faces': [i]})
         else:
             # Track faces attached to this corner for us in small cut checks.
-            tight_corner_sets.append(interesting_fs)
-            u1, u2, v1, v2 = c.ParameterRange
-            angle = c.normalAt(u1, v1).getAngle(c.normalAt(u2, v2))
-            if angle > shallow_limit:
-                issues.append({'issue': 'tight-corner', 'faces': None})
+            a.tight_corner_sets.append(interesting_fs)
+            u1, u2, v1, v2 = c.parameter_range
+            angle = c.face.normalAt(u1, v1).getAngle(c.face.normalAt(u2, v2))
+            a.instr.count('normalAt_calls', 2)
+            if angle > SHALLOW_LIMIT:
+                a.issues.append({'issue': 'tight-corner', 'faces': None})
             else:
-                issues.append({'issue': 'tight-corner-mild', 'faces': None})
-
-    # Check for small cuts.  Looks for any faces (not counting the horizontal
-    # ones) that are not connected to each other, checks the distance between
-    # them, then checks whether the space between them is solid or void.
-    seen = set()
-    for f1 in set(faces) - horizontal_planes:
-        seen.add(f1)
-        connected_fs = {f2.Shape for f2 in face_to_faces[HashShape(f1)]}
-        interesting_fs = set(faces) - connected_fs - horizontal_planes - seen
-        for f2 in interesting_fs:
-            # A small radius in an internal corner can be confused for a thin
-            # cut.  Ignore any face pairs that are part of such a corner.
-            is_tight_corner = False
-            for tight_corner in tight_corner_sets:
-                if tight_corner.issuperset([f1, f2]):
-                    is_tight_corner = True
-                    break
-            if is_tight_corner:
-                continue
-            # Precise distance checks are expensive, so first check if the
-            # bounding boxes of the two surfaces are close enough to even
-            # potentially be a concern.
-            bound_box1 = f1.BoundBox
-            bound_box1.enlarge(0.5 * kerf_width)
-            bound_box2 = f2.BoundBox
-            bound_box2.enlarge(0.5 * kerf_width)
-            if not bound_box1.intersect(bound_box2):
-                continue
-            # If bounding boxes are close, next check precise distance.
-            dist, vecs, info = f1.distToShape(f2)
-            if dist > kerf_width:
-                continue
-            # Check that the vector from one face to the other is in the same
-            # general direction as the face normal.  If they are, then this is
-            # empty area, and is an issue.  Otherwise, this is a thin solid
-            # section that should not be a problem.
-            trans1 = vecs[0][1] - vecs[0][0]
-            n1 = f1.normalAt(*f1.Surface.parameter(vecs[0][0]))
-            if n1.dot(trans1) < 0:
-                continue
-            trans2 = trans1.multiply(-1)
-            n2 = f2.normalAt(*f2.Surface.parameter(vecs[0][1]))
-            if n2.dot(trans2) < 0:
-                continue
-            issues.append({'issue': 'small-cut',
-                           'faces': [faces.index(f1), faces.index(f2)]})
-
-    # Check for drafts and chamfers.  These will be any planes on an angle and
-    # any vertical cones that are not already considered countersinks.  Drafts
-    # and chamfers are distinguished by whether they extend through the full
-    # thickness of the part.  Each issue will only be added to the list once.
-    # NOTE Certain cases of angled planes may be better classified as "non-
-    # uniform", but this code does not consider that.
-    unhandled_vertical_cones = vertical_cones - countersink_cones
-    zmax = shape.BoundBox.ZMax
-    zmin = shape.BoundBox.ZMin
+                a.issues.append({'issue': 'tight-corner-mild', 'faces': None})
+
+
+@check('small_cut', issues=['small-cut'], requires=['small_hole'], cost=3,
+       uses_kerf=True)
+def check_small_cut(a):
+    """Check for small cuts.
+
+    Looks for any faces (not counting the horizontal ones) that are not
+    connected to each other, checks the distance between them, then checks
+    whether the space between them is solid or void.
+
+    Precise distance checks are expensive, so first find the pairs of faces
+    whose bounding boxes, each enlarged by half the kerf width, are close
+    enough to even potentially be a concern.  A tree over those boxes finds
+    the pairs without comparing every face against every other face.
+
+    When the part is a flat profile extruded straight up, the distance between
+    two walls is the distance between their top edges, so most pairs can be
+    settled in 2D from the outline of the top face.  Otherwise, with
+    a.mid_phase, pairs can be settled from bounds on their distance found from
+    points sampled from each face.
+
+    """
+    kerf_width = a.kerf_width
+    profile = None
+    if a.measured is None:
+        profile = extract_profile(a, PROFILE_DEFLECTION * kerf_width)
+    else:
+        profile = a.profile
+    wall_faces = sorted(a.all_faces - a.horizontal_planes)
+    box_tree = BoxTree(box_of(a.face_info[i].bound_box, 0.5 * kerf_width)
+                       for i in wall_faces)
+    close_pairs = box_tree.pairs()
+    n_pairs = len(wall_faces) * (len(wall_faces) - 1) // 2
+    a.instr.count('pairs_considered', n_pairs)
+    a.instr.count('pairs_pruned_by_box', n_pairs - len(close_pairs))
+    candidates = []
+    for j1, j2 in close_pairs:
+        i1, i2 = wall_faces[j1], wall_faces[j2]
+        if i2 in a.topology.adjacent_faces(i1):
+            continue
+        # A small radius in an internal corner can be confused for a thin
+        # cut.  Ignore any face pairs that are part of such a corner.
+        is_tight_corner = False
+        for tight_corner in a.tight_corner_sets:
+            if tight_corner.issuperset([i1, i2]):
+                is_tight_corner = True
+                break
+        if is_tight_corner:
+            continue
+        candidates.append((i1, i2))
+
+    # Use results for pairs seen before from the incremental state, and work
+    # out the rest, in worker processes if asked for.
+    found = {}
+    keys = {}
+    if a.state is not None:
+        for i1, i2 in candidates:
+            key = a.state.pair_key('small_cut', a.fingerprint(i1),
+                                   a.fingerprint(i2), kerf_width)
+            result = a.state.get(key)
+            if result is None:
+                keys[(i1, i2)] = key
+            else:
+                found[(i1, i2)] = result
+        a.instr.count('incremental_hits', len(found))
+        a.instr.count('incremental_misses', len(keys))
+    pending = [pair for pair in candidates if pair not in found]
+    if a.processes and len(pending) > 1:
+        results = _small_cut_parallel(a, profile, pending)
+    else:
+        results = _small_cut_serial(a, profile, pending)
+    for pair, result in results:
+        found[pair] = result
+        if pair in keys:
+            a.state.put(keys[pair], result)
+
+    for pair in candidates:
+        if found.get(pair):
+            a.issues.append({'issue': 'small-cut', 'faces': list(pair)})
+
+
+def _small_cut_serial(a, profile, pairs):
+    "Iterate over (pair, _is_small_cut result) for each pair of faces."
+    for i1, i2 in pairs:
+        if a.time_up():
+            return
+        yield (i1, i2), _is_small_cut(a, profile, i1, i2)
+
+
+def _small_cut_parallel(a, profile, pairs):
+    """Iterate over (pair, _is_small_cut result), using worker processes.
+
+    The pairs are split into chunks, which are sent to a pool of a.processes
+    workers.  Each worker loads its own copy of the shape from a BREP string
+    when it starts, and is then only sent face indices.  Results come back in
+    the same order as the pairs, so the issues found do not depend on how the
+    work was split up.
+
+    """
+    n_chunks = min(len(pairs), 4 * a.processes)
+    size = -(-len(pairs) // n_chunks)
+    chunks = [pairs[k:k + size] for k in range(0, len(pairs), size)]
+    pool = Pool(a.processes, initializer=_init_pair_worker,
+                initargs=(a.shape.exportBrepToString(), a.kerf_width, profile,
+                          a.mid_phase))
+    try:
+        for chunk, (results, counters) in zip(
+                chunks, pool.imap(_check_pairs, chunks)):
+            for name, n in counters.items():
+                a.instr.count(name, n)
+            for pair, result in zip(chunk, results):
+                yield pair, result
+            if a.time_up():
+                return
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _PairContext(object):
+    "Just enough of an Analysis for _is_small_cut to run in a worker process."
+    measured = None
+
+    def __init__(self, faces, kerf_width, profile, mid_phase):
+        self.faces = faces
+        self.face_info = [FaceInfo(f) for f in faces]
+        self.kerf_width = kerf_width
+        self.profile = profile
+        self.mid_phase = mid_phase
+        self.samples = {}
+        self.instr = Instrumentation()
+
+
+# Context of the current process, when it is a worker for small cut pairs.
+_pair_context = None
+
+
+def _init_pair_worker(brep, kerf_width, profile, mid_phase):
+    global _pair_context
+    shape = Part.Shape()
+    shape.importBrepFromString(brep)
+    _pair_context = _PairContext(shape.Faces, kerf_width, profile, mid_phase)
+
+
+def _check_pairs(pairs):
+    "Check a chunk of pairs in a worker, returning (results, counters)."
+    context = _pair_context
+    context.instr = Instrumentation()
+    results = [_is_small_cut(context, context.profile, i1, i2)
+               for i1, i2 in pairs]
+    return results, dict(context.instr.counters)
+
+
+def _is_small_cut(a, profile, i1, i2):
+    "Check whether two faces that are not connected form a small cut."
+    kerf_width = a.kerf_width
+    f1, f2 = a.faces[i1], a.faces[i2]
+    if a.measured is not None:
+        if (i1, i2) not in a.measured:
+            a.measured[(i1, i2)] = _measure(a, profile, i1, i2)
+        dist, void, exact = a.measured[(i1, i2)]
+        if not exact:
+            # Measured in 2D, so settle the pair as below if the distance is
+            # clear enough of this kerf width, and otherwise measure it again.
+            margin = 2 * profile.deflection
+            if dist > kerf_width + margin:
+                return False
+            if margin < dist < kerf_width - margin:
+                return void
+            dist, void, exact = _measure_exactly(a, i1, i2)
+        return dist <= kerf_width and void
+    if profile is not None:
+        # Settle the pair from the outlines unless their distance is too near
+        # the kerf width, or too near zero for the closest points to give a
+        # reliable direction.
+        dist, p1, p2 = profile.distance(i1, i2)
+        margin = 2 * profile.deflection
+        if dist > kerf_width + margin:
+            a.instr.count('pairs_settled_in_2d')
+            return False
+        if margin < dist < kerf_width - margin:
+            a.instr.count('pairs_settled_in_2d')
+            return _is_void(a, i1, i2, FreeCAD.Vector(p1[0], p1[1], profile.z),
+                            FreeCAD.Vector(p2[0], p2[1], profile.z))
+    elif a.mid_phase:
+        # As above, but from points sampled from the faces, and only once the
+        # faces are certainly apart.
+        samples1 = _face_samples(a, i1)
+        samples2 = _face_samples(a, i2)
+        if samples1 is not None and samples2 is not None:
+            lower, upper, p1, p2 = samples1.bounds(samples2)
+            if lower > kerf_width:
+                a.instr.count('pairs_settled_by_samples')
+                return False
+            if 0 < lower and upper <= kerf_width:
+                a.instr.count('pairs_settled_by_samples')
+                return _is_void(a, i1, i2, FreeCAD.Vector(*p1),
+                                FreeCAD.Vector(*p2))
+    # If bounding boxes are close, next check precise distance.
+    dist, vecs, info = f1.distToShape(f2)
+    a.instr.count('distToShape_calls')
+    if dist > kerf_width:
+        return False
+    return _is_void(a, i1, i2, vecs[0][0], vecs[0][1])
+
+
+def _measure(a, profile, i1, i2):
+    """Measure a pair of faces for every kerf width, returning a tuple.
+
+    The tuple is (distance, void, exact), where void says whether the space
+    between the faces is void, as _is_void.  When there is a profile the
+    distance is between the outlines, and not exact.  void is then None if
+    the outlines are too close together to tell.
+
+    """
+    if profile is None:
+        return _measure_exactly(a, i1, i2)
+    dist, p1, p2 = profile.distance(i1, i2)
+    void = None
+    if dist > 2 * profile.deflection:
+        void = _is_void(a, i1, i2, FreeCAD.Vector(p1[0], p1[1], profile.z),
+                        FreeCAD.Vector(p2[0], p2[1], profile.z))
+    return dist, void, False
+
+
+def _measure_exactly(a, i1, i2):
+    "As _measure, but always exact, replacing anything in a.measured."
+    entry = a.measured.get((i1, i2))
+    if entry is None or not entry[2]:
+        dist, vecs, info = a.faces[i1].distToShape(a.faces[i2])
+        a.instr.count('distToShape_calls')
+        entry = (dist, _is_void(a, i1, i2, vecs[0][0], vecs[0][1]), True)
+        a.measured[(i1, i2)] = entry
+    return entry
+
+
+def _face_samples(a, i):
+    "FaceSamples for face i, or None if it has too many to be worth it."
+    if i not in a.samples:
+        a.instr.count('faces_sampled')
+        kerf_width = a.kerf_width
+        a.samples[i] = sample_face(
+            a.faces[i], MID_PHASE_SPACING * kerf_width,
+            MID_PHASE_DEFLECTION * kerf_width, MID_PHASE_MAX_POINTS)
+    return a.samples[i]
+
+
+def _is_void(a, i1, i2, p1, p2):
+    """Check whether the space between the closest points of two faces is void.
+
+    Check that the vector from one face to the other is in the same general
+    direction as the face normal.  If they are, then this is empty area, and
+    is an issue.  Otherwise, this is a thin solid section that should not be a
+    problem.
+
+    """
+    trans1 = p2 - p1
+    n1 = a.faces[i1].normalAt(*a.face_info[i1].surface.parameter(p1))
+    a.instr.count('normalAt_calls')
+    if n1.dot(trans1) < 0:
+        return False
+    trans2 = trans1.multiply(-1)
+    n2 = a.faces[i2].normalAt(*a.face_info[i2].surface.parameter(p2))
+    a.instr.count('normalAt_calls')
+    return n2.dot(trans2) >= 0
+
+
+@check('draft_chamfer', issues=['draft', 'chamfer'], requires=['counter_sink'])
+def check_draft_chamfer(a):
+    """Check for drafts and chamfers.
+
+    These will be any planes on an angle and any vertical cones that are not
+    already considered countersinks.  Drafts and chamfers are distinguished by
+    whether they extend through the full thickness of the part.  Each issue
+    will only be added to the list once.
+
+    NOTE Certain cases of angled planes may be better classified as "non-
+    uniform", but this code does not consider that.
+
+    """
+    unhandled_vertical_cones = a.vertical_cones - a.countersink_cones
+    zmax = a.shape.BoundBox.ZMax
+    zmin = a.shape.BoundBox.ZMin
     drafted = False
     chamfered = False
-    for f in chain(angled_planes, unhandled_vertical_cones):
-        if is_close(f.BoundBox.ZMax, zmax) and is_close(f.BoundBox.ZMin, zmin):
+    for i in chain(sorted(a.angled_planes), sorted(unhandled_vertical_cones)):
+        f = a.face_info[i]
+        if is_close(f.zmax, zmax) and is_close(f.zmin, zmin):
             if not drafted:
-                issues.append({'issue': 'draft', 'faces': None})
+                a.issues.append({'issue': 'draft', 'faces': None})
                 drafted = True
         else:
             if not chamfered:
-                issues.append({'issue': 'chamfer', 'faces': None})
+                a.issues.append({'issue': 'chamfer', 'faces': None})
                 chamfered = True
 
-    # Check for non-uniform thickness that is not otherwise covered by one of
-    # the previous issues.  At this point, the only unhandled geometry still
-    # remaining are horizontal surfaces that are not the top and bottom and are
-    # not part of counterbores.
-    if len(horizontal_planes - counterbore_planes) != 2:
-        issues.append({'issue': 'non-uniform', 'faces': None})
 
-    return {'issues': issues}
+@check('thickness', issues=['non-uniform'], requires=['counter_bore'])
+def check_thickness(a):
+    """Check for non-uniform thickness not covered by the other checks.
+
+    At this point, the only unhandled geometry still remaining are horizontal
+    surfaces that are not the top and bottom and are not part of counterbores.
+
+    """
+    if len(a.horizontal_planes - a.counterbore_planes) != 2:
+        a.issues.append({'issue': 'non-uniform', 'faces': None})
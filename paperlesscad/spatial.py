@@ -0,0 +1,257 @@
+"""Spatial indexing structures to quickly find nearby shapes."""
+
+from __future__ import absolute_import, division
+
+from collections import defaultdict
+from itertools import product
+from math import floor
+
+import numpy as np
+
+
+def box_of(bound_box, pad=0.0):
+    """Convert a FreeCAD BoundBox into a plain tuple.
+
+    The tuple is (xmin, ymin, zmin, xmax, ymax, zmax), with every side pushed
+    outwards by pad, the same as BoundBox.enlarge would do.
+
+    """
+    return (bound_box.XMin - pad, bound_box.YMin - pad, bound_box.ZMin - pad,
+            bound_box.XMax + pad, bound_box.YMax + pad, bound_box.ZMax + pad)
+
+
+def boxes_overlap(a, b):
+    "Check if two box tuples touch or overlap, as BoundBox.intersect does."
+    return (a[0] <= b[3] and b[0] <= a[3]
+            and a[1] <= b[4] and b[1] <= a[4]
+            and a[2] <= b[5] and b[2] <= a[5])
+
+
+def _merge(boxes):
+    "Smallest box tuple containing all given box tuples."
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            min(b[2] for b in boxes), max(b[3] for b in boxes),
+            max(b[4] for b in boxes), max(b[5] for b in boxes))
+
+
+class BoxTree(object):
+    """Bounding volume hierarchy over a fixed list of box tuples.
+
+    The tree is built once by repeatedly splitting the boxes at the median of
+    their centres along the longest axis.  It can then be asked for all boxes
+    that overlap a given box, which takes roughly logarithmic time instead of
+    comparing against every box.
+
+    """
+    leaf_size = 4
+
+    def __init__(self, boxes):
+        self.boxes = list(boxes)
+        # Each node is a list [box, start, end, left, right].  Leaves have no
+        # children and hold the boxes self.order[start:end].
+        self.nodes = []
+        self.order = list(range(len(self.boxes)))
+        if self.boxes:
+            self._build(0, len(self.order))
+
+    def _build(self, start, end):
+        node_id = len(self.nodes)
+        box = _merge([self.boxes[i] for i in self.order[start:end]])
+        node = [box, start, end, None, None]
+        self.nodes.append(node)
+        if end - start <= self.leaf_size:
+            return node_id
+        extents = [box[k + 3] - box[k] for k in range(3)]
+        axis = extents.index(max(extents))
+        self.order[start:end] = sorted(
+            self.order[start:end],
+            key=lambda i: self.boxes[i][axis] + self.boxes[i][axis + 3])
+        middle = (start + end) // 2
+        node[3] = self._build(start, middle)
+        node[4] = self._build(middle, end)
+        return node_id
+
+    def query(self, box):
+        "Iterate over indices of all boxes that overlap the given box."
+        if not self.nodes:
+            return
+        stack = [0]
+        while stack:
+            node_box, start, end, left, right = self.nodes[stack.pop()]
+            if not boxes_overlap(node_box, box):
+                continue
+            if left is None:
+                for i in self.order[start:end]:
+                    if boxes_overlap(self.boxes[i], box):
+                        yield i
+            else:
+                stack.append(right)
+                stack.append(left)
+
+    def pairs(self):
+        """List all pairs of overlapping boxes.
+
+        Each pair (i, j) is given once with i < j, and the list is sorted so
+        that the result does not depend on how the tree was built.
+
+        """
+        found = []
+        for i, box in enumerate(self.boxes):
+            found.extend((i, j) for j in self.query(box) if j > i)
+        found.sort()
+        return found
+
+
+class PointTree(object):
+    """k-d tree over a fixed array of 3D points.
+
+    Built the same way as BoxTree, splitting at the median along the longest
+    side of each node's box until the leaves hold at most leaf_size points.
+    Points within leaves are compared all at once with NumPy, so leaves are
+    kept fairly large.
+
+    """
+    leaf_size = 64
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+        # Each node is a list [low, high, start, end, left, right], where low
+        # and high are corners of the box around the points
+        # self.points[self.order[start:end]].
+        self.nodes = []
+        self.order = np.arange(len(self.points))
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        node_id = len(self.nodes)
+        points = self.points[self.order[start:end]]
+        low = points.min(axis=0)
+        high = points.max(axis=0)
+        node = [low, high, start, end, None, None]
+        self.nodes.append(node)
+        if end - start <= self.leaf_size:
+            return node_id
+        axis = np.argmax(high - low)
+        self.order[start:end] = self.order[start:end][
+            np.argsort(points[:, axis], kind='mergesort')]
+        middle = (start + end) // 2
+        node[4] = self._build(start, middle)
+        node[5] = self._build(middle, end)
+        return node_id
+
+    def _leaf_points(self, node):
+        return self.points[self.order[node[2]:node[3]]]
+
+    def nearest_pair(self, other):
+        """Closest pair of points between this tree and another.
+
+        Returns (distance, i, j), where i and j index self.points and
+        other.points.  Returns (inf, None, None) if either tree is empty.
+
+        """
+        best = (float('inf'), None, None)
+        if not (self.nodes and other.nodes):
+            return best
+        stack = [(0.0, 0, 0)]
+        while stack:
+            gap, n1, n2 = stack.pop()
+            if gap >= best[0]:
+                continue
+            node1 = self.nodes[n1]
+            node2 = other.nodes[n2]
+            if node1[4] is None and node2[4] is None:
+                d2 = ((self._leaf_points(node1)[:, np.newaxis, :]
+                       - other._leaf_points(node2)[np.newaxis, :, :]) ** 2
+                      ).sum(axis=2)
+                k1, k2 = np.unravel_index(np.argmin(d2), d2.shape)
+                dist = np.sqrt(d2[k1, k2])
+                if dist < best[0]:
+                    best = (dist, self.order[node1[2] + k1],
+                            other.order[node2[2] + k2])
+                continue
+            # Split whichever node is larger, and look at the nearer half
+            # first.
+            size1 = node1[3] - node1[2]
+            size2 = node2[3] - node2[2]
+            if node2[4] is None or (node1[4] is not None and size1 >= size2):
+                pairs = [(self.nodes[c], node2, c, n2) for c in node1[4:6]]
+            else:
+                pairs = [(node1, other.nodes[c], n1, c) for c in node2[4:6]]
+            children = sorted(((_box_gap(c1, c2), m1, m2)
+                               for c1, c2, m1, m2 in pairs), reverse=True)
+            stack.extend(children)
+        return best
+
+
+def _box_gap(node1, node2):
+    "Distance between the boxes of two PointTree nodes."
+    gap = np.maximum(0.0, np.maximum(node1[0] - node2[1], node2[0] - node1[1]))
+    return np.sqrt((gap ** 2).sum())
+
+
+class AxisIndex(object):
+    """Index of items by the XY location of their vertical axis.
+
+    Locations are bucketed on a square grid, so finding the items that share
+    an axis with a given item only has to look in neighbouring grid cells
+    rather than at every other item.  Two axes are the same if both their x
+    and y are within tol of each other, as with utils.is_close.  The grid cell
+    must be larger than tol for that to work.
+
+    """
+
+    def __init__(self, tol=1e-13, cell=1e-6):
+        assert cell > tol
+        self.tol = tol
+        self.cell = cell
+        self.locations = {}
+        self.buckets = defaultdict(list)
+
+    def _cell_of(self, x, y):
+        return int(floor(x / self.cell)), int(floor(y / self.cell))
+
+    def add(self, item, x, y):
+        self.locations[item] = (x, y)
+        self.buckets[self._cell_of(x, y)].append(item)
+
+    def coaxial(self, item):
+        "Sorted list of other items that share an axis with the given item."
+        x, y = self.locations[item]
+        cx, cy = self._cell_of(x, y)
+        found = []
+        for dx, dy in product((-1, 0, 1), repeat=2):
+            for other in self.buckets.get((cx + dx, cy + dy), ()):
+                ox, oy = self.locations[other]
+                if (other != item and abs(ox - x) < self.tol
+                        and abs(oy - y) < self.tol):
+                    found.append(other)
+        found.sort()
+        return found
+
+    def groups(self):
+        """List groups of two or more items that share an axis.
+
+        Each group is a sorted list, and the groups are sorted by their first
+        item.  Items are grouped if they are connected by a chain of shared
+        axes.
+
+        """
+        seen = set()
+        groups = []
+        for item in sorted(self.locations):
+            if item in seen:
+                continue
+            group = []
+            stack = [item]
+            seen.add(item)
+            while stack:
+                current = stack.pop()
+                group.append(current)
+                for other in self.coaxial(current):
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+            if len(group) > 1:
+                groups.append(sorted(group))
+        return groups
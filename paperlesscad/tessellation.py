@@ -0,0 +1,82 @@
+"""Points sampled from faces, for bounding the distance between them.
+
+A face is tessellated by OCC into triangles that stay within a given
+deflection of it, and the triangles are then divided up until no side is
+longer than a given spacing.  Every point of the face is then within the
+spacing plus the deflection of one of the corners, and every corner is within
+the deflection of the face.  The closest pair of corners of two faces, found
+with a PointTree, gives bounds on the distance between the faces either side
+of the true distance, without asking OCC for it.
+
+"""
+
+from __future__ import absolute_import, division
+
+from math import ceil
+
+import numpy as np
+
+from paperlesscad.spatial import PointTree
+
+
+class FaceSamples(object):
+    """Points sampled from a face, in a PointTree.
+
+    Every point of the face is within radius of one of the points, and every
+    point is within deflection of the face.
+
+    """
+
+    def __init__(self, points, radius, deflection):
+        self.tree = PointTree(points)
+        self.radius = radius
+        self.deflection = deflection
+
+    def bounds(self, other):
+        """Bounds on the distance between this face and another.
+
+        Returns (lower, upper, point1, point2), where the points are the
+        closest pair of samples on each face.
+
+        """
+        dist, i, j = self.tree.nearest_pair(other.tree)
+        lower = dist - self.radius - other.radius
+        upper = dist + self.deflection + other.deflection
+        return lower, upper, self.tree.points[i], other.tree.points[j]
+
+
+# Barycentric coordinates of the corners when a triangle is divided into n by n
+# smaller ones, by n.
+_divisions = {}
+
+
+def _barycentric(n):
+    if n not in _divisions:
+        _divisions[n] = np.array([(n - j - k, j, k)
+                                  for j in range(n + 1)
+                                  for k in range(n + 1 - j)]) / n
+    return _divisions[n]
+
+
+def sample_face(face, spacing, deflection, max_points):
+    """Sample points from a face, returning FaceSamples.
+
+    Returns None if that would take more than max_points points.
+
+    NOTE The deflection is passed on to OCC's tessellation, which keeps to it
+    closely but does not strictly promise to.
+
+    """
+    vertices, triangles = face.tessellate(deflection)
+    if not triangles:
+        return None
+    vertices = np.array([(v.x, v.y, v.z) for v in vertices])
+    corners = vertices[np.array(triangles)]
+    sides = np.sqrt(((corners - np.roll(corners, 1, axis=1)) ** 2
+                     ).sum(axis=2)).max(axis=1)
+    divisions = [max(1, int(ceil(s / spacing))) for s in sides]
+    if sum((n + 1) * (n + 2) // 2 for n in divisions) > max_points:
+        return None
+    points = [_barycentric(n).dot(c) for n, c in zip(divisions, corners)]
+    return FaceSamples(np.concatenate(points), spacing + deflection,
+                       deflection)
@@ -1,6 +1,40 @@
+import glob
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
 from collections import Counter
-from paperlesscad.solution import dfm_check
+from itertools import combinations
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+import numpy as np
+
+from paperlesscad import benchmark, prescan, solution
+from paperlesscad.batch import check_many
+from paperlesscad.cache import GeometryCache, ResultCache
+from paperlesscad.incremental import IncrementalState
+from paperlesscad.outline import segments_distance
+from paperlesscad.sampling import (
+    grid_levels, has_vertical_normals, NormalSampler)
+from paperlesscad.server import CheckServer
+from paperlesscad.solution import (
+    CHECKS, dfm_check, dfm_sweep, plan_checks, run_order)
+from paperlesscad.spatial import AxisIndex, BoxTree, boxes_overlap, PointTree
+from paperlesscad.tessellation import sample_face
+from paperlesscad.utils import FaceInfo, is_concave, Topology
+# The asyncio front end, and so its tests, need Python 3.7 syntax.
+if sys.version_info >= (3, 7):
+    from paperlesscad.test_aio import TestAsyncChecker  # noqa: F401
+
+import FreeCAD
+import Part
 
 
 def summarize(results):
@@ -8,6 +42,27 @@ def summarize(results):
     return Counter(i['issue'] for i in results['issues'])
 
 
+def make_chamfered_holes(path, pitch=10.5, radius=5.0, thickness=3.0):
+    """Plate with a 2 by 2 grid of holes, and one chamfered top edge.
+
+    The chamfer keeps the part from being a plain extruded profile.  With a
+    kerf width of 1, neighbouring holes are too close, while diagonal ones
+    have bounding boxes within the kerf width but walls well apart.
+
+    """
+    margin = radius + 3.0
+    size = pitch + 2 * margin
+    plate = Part.makeBox(size, size, thickness)
+    edge = [e for e in plate.Edges if e.BoundBox.ZMin == thickness
+            and e.BoundBox.YMax == 0][0]
+    plate = plate.makeChamfer(0.5, [edge])
+    holes = [Part.makeCylinder(radius, thickness,
+                               FreeCAD.Vector(margin + i * pitch,
+                                              margin + j * pitch, 0))
+             for i in range(2) for j in range(2)]
+    plate.cut(Part.makeCompound(holes)).exportStep(path)
+
+
 class TestSolution(unittest.TestCase):
 
     def test_good_part(self):
@@ -89,6 +144,153 @@ class TestSolution(unittest.TestCase):
             result['issues'][0]['issue'])
         self.assertTrue(len(result['issues'][0]['faces']) >= 1)
 
+    def test_axes(self):
+        result = dfm_check('step_files/counter_bore.STEP', axes=True)
+        bore = result['issues'][0]['faces']
+        self.assertTrue(any(set(bore[:2]) <= set(group['faces'])
+                            for group in result['axes']))
+        result = dfm_check('step_files/counter_sinks.STEP', axes=True)
+        sink = result['issues'][0]['faces']
+        self.assertTrue(any(set(sink) <= set(group['faces'])
+                            for group in result['axes']))
+        self.assertNotIn('axes', dfm_check('step_files/good_part.STEP'))
+
+    def test_metrics(self):
+        calls = []
+        result = dfm_check('step_files/small_hole.STEP', instrument=True,
+                           hook=lambda *args: calls.append(args))
+        metrics = result.pop('metrics')
+        self.assertEqual(dfm_check('step_files/small_hole.STEP'), result)
+        self.assertEqual([('step_files/small_hole.STEP', metrics)], calls)
+        self.assertIn('small_cut', metrics['timings'])
+        counters = Counter(metrics['counters'])
+        pairs_checked = (counters['distToShape_calls']
+                         + counters['pairs_settled_in_2d'])
+        self.assertGreater(pairs_checked, 0)
+        self.assertGreaterEqual(counters['pairs_considered'],
+                                counters['pairs_pruned_by_box']
+                                + pairs_checked)
+
+    def test_issue_types(self):
+        path = 'step_files/thin_cut_between_radii.step'
+        full = dfm_check(path)
+        wanted = {'small-hole', 'tight-corner', 'tight-corner-mild'}
+        expected = [i for i in full['issues'] if i['issue'] in wanted]
+        result = dfm_check(path, issue_types=wanted, instrument=True)
+        self.assertEqual(expected, result['issues'])
+        self.assertNotIn('small_cut', result['metrics']['timings'])
+        result = dfm_check('step_files/counter_confusion.step',
+                           issue_types=['non-uniform'])
+        self.assertEqual({'issues': [{'issue': 'non-uniform',
+                                      'faces': None}]}, result)
+        self.assertRaises(ValueError, dfm_check, path,
+                          issue_types=['no-such-issue'])
+
+    def test_plan_checks(self):
+        names = [c.name for c in plan_checks(['small-cut'])]
+        self.assertEqual(['surfaces', 'freeform', 'small_hole', 'small_cut'],
+                         names)
+        names = [c.name for c in plan_checks(['non-uniform'])]
+        self.assertNotIn('small_cut', names)
+        self.assertEqual([c.name for c in CHECKS],
+                         [c.name for c in plan_checks()])
+
+    def test_run_order(self):
+        order = [c.name for c in run_order(CHECKS)]
+        self.assertEqual(sorted(c.name for c in CHECKS), sorted(order))
+        self.assertEqual(['surfaces', 'freeform'], order[:2])
+        self.assertEqual('small_cut', order[-1])
+        for k, c in enumerate(run_order(CHECKS)):
+            self.assertTrue(set(c.requires).issubset(order[:k]))
+
+    def test_budget(self):
+        path = 'step_files/thin_cut_between_radii.step'
+        result = dfm_check(path, budget=60)
+        self.assertEqual([], result.pop('skipped'))
+        self.assertEqual([], result.pop('partial'))
+        self.assertEqual(dfm_check(path), result)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = ResultCache(directory)
+        result = dfm_check(path, budget=0, cache=cache)
+        self.assertEqual([], result['issues'])
+        self.assertEqual(sorted(c.name for c in CHECKS),
+                         sorted(result['skipped'] + result['partial']))
+        self.assertEqual(0, cache.stats()['entries'])
+
+        result = dfm_check(path, axes=True, budget=0)
+        self.assertIsNone(result['axes'])
+        self.assertIn('surfaces', result['skipped'])
+
+    def test_sweep(self):
+        for path in ('step_files/small_hole.STEP',
+                     'step_files/thin_cut_between_radii.step',
+                     'step_files/nonuniform.STEP'):
+            kerf_widths = [0.5, None, 10.0]
+            sweep = dfm_sweep(path, kerf_widths)
+            # A small hole's threshold is a strict bound.
+            for t in sweep['thresholds']:
+                if t['issue'] == 'small-hole':
+                    issue = {'issue': t['issue'], 'faces': t['faces']}
+                    self.assertNotIn(
+                        issue, dfm_check(path, t['kerf_width'])['issues'])
+            for kerf_width, result in zip(kerf_widths, sweep['results']):
+                self.assertEqual(dfm_check(path, kerf_width)['issues'],
+                                 result['issues'])
+            for t in sweep['thresholds']:
+                for result in sweep['results']:
+                    issue = {'issue': t['issue'], 'faces': t['faces']}
+                    if issue not in result['issues']:
+                        continue
+                    if t['issue'] == 'small-hole':
+                        self.assertLess(t['kerf_width'], result['kerf_width'])
+                    else:
+                        self.assertLessEqual(t['kerf_width'],
+                                             result['kerf_width'])
+
+    def test_sweep_no_kerf_widths(self):
+        self.assertEqual({'results': [], 'thresholds': []},
+                         dfm_sweep('step_files/small_hole.STEP', []))
+
+    def test_parallel_small_cut(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'slots.step')
+        benchmark.make_slot_array(path, 6)
+        for p in (path, 'step_files/thin_cut_between_radii.step'):
+            serial = dfm_check(p, instrument=True)
+            parallel = dfm_check(p, instrument=True, processes=2)
+            self.assertEqual(serial['issues'], parallel['issues'])
+            self.assertEqual(serial['metrics']['counters'],
+                             parallel['metrics']['counters'])
+
+    def test_mid_phase(self):
+        for path in sorted(glob.glob('step_files/*')):
+            self.assertEqual(dfm_check(path),
+                             dfm_check(path, mid_phase=True), path)
+
+        # Not an extruded profile, so pairs are not settled in 2D first.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'chamfered_holes.step')
+        make_chamfered_holes(path)
+        result = dfm_check(path, 1.0, mid_phase=True, instrument=True)
+        counters = result.pop('metrics')['counters']
+        self.assertGreater(counters['pairs_settled_by_samples'], 0)
+        self.assertEqual(0, counters.get('pairs_settled_in_2d', 0))
+        self.assertEqual(dfm_check(path, 1.0), result)
+
+    def test_sharp_corner_plane_normals(self):
+        path = 'step_files/sharp_internal_corner.step'
+        counters = dfm_check(path, issue_types=['tight-corner'],
+                             instrument=True)['metrics']['counters']
+        self.assertGreater(counters['vertical_edges'], 0)
+        # Each plane's normal is only asked for once, however many vertical
+        # edges it has.
+        self.assertLess(counters['normalAt_calls'],
+                        2 * counters['vertical_edges'])
+
     def test_small_outside_edge(self):
         result = dfm_check('step_files/small_outside_edge.step')
         self.assertEqual(result, {'issues': []})
@@ -160,5 +362,481 @@ class TestSolution(unittest.TestCase):
         summary = summarize(result)
         self.assertIn('non-uniform', summary)
 
+
+class TestBoxTree(unittest.TestCase):
+
+    def test_pairs_match_all_pairs_scan(self):
+        rng = random.Random(0)
+        boxes = []
+        for _ in range(200):
+            x, y, z = (rng.uniform(0, 100) for _ in range(3))
+            dx, dy, dz = (rng.uniform(0, 10) for _ in range(3))
+            boxes.append((x, y, z, x + dx, y + dy, z + dz))
+        expected = [(i, j) for i, j in combinations(range(len(boxes)), 2)
+                    if boxes_overlap(boxes[i], boxes[j])]
+        self.assertEqual(expected, BoxTree(boxes).pairs())
+
+    def test_touching_boxes_overlap(self):
+        tree = BoxTree([(0, 0, 0, 1, 1, 1), (1, 0, 0, 2, 1, 1)])
+        self.assertEqual([(0, 1)], tree.pairs())
+
+    def test_empty(self):
+        self.assertEqual([], BoxTree([]).pairs())
+
+
+class TestPointTree(unittest.TestCase):
+
+    def test_nearest_pair_matches_all_pairs_scan(self):
+        rng = np.random.RandomState(0)
+        points1 = rng.uniform(0, 10, (500, 3))
+        points2 = rng.uniform(5, 15, (300, 3))
+        dist, i, j = PointTree(points1).nearest_pair(PointTree(points2))
+        all_pairs = np.sqrt(((points1[:, np.newaxis, :]
+                              - points2[np.newaxis, :, :]) ** 2).sum(axis=2))
+        self.assertAlmostEqual(all_pairs.min(), dist)
+        self.assertAlmostEqual(all_pairs[i, j], dist)
+
+    def test_empty(self):
+        tree = PointTree(np.zeros((0, 3)))
+        self.assertEqual((float('inf'), None, None),
+                         tree.nearest_pair(PointTree([(0, 0, 0)])))
+
+
+class TestTessellation(unittest.TestCase):
+
+    def test_bounds_contain_distance(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'chamfered_holes.step')
+        make_chamfered_holes(path)
+        shape = Part.Shape()
+        shape.read(path)
+        walls = [f for f in shape.Faces
+                 if isinstance(f.Surface, Part.Cylinder)]
+        self.assertGreaterEqual(len(walls), 4)
+        samples = [sample_face(f, 0.25, 0.01, 50000) for f in walls]
+        for i, j in combinations(range(len(walls)), 2):
+            lower, upper, p1, p2 = samples[i].bounds(samples[j])
+            dist = walls[i].distToShape(walls[j])[0]
+            self.assertLessEqual(lower, dist)
+            self.assertLessEqual(dist, upper)
+            self.assertLess(upper - lower, 1.0)
+
+
+class TestAxisIndex(unittest.TestCase):
+
+    def test_coaxial_and_groups(self):
+        index = AxisIndex(tol=1e-9, cell=1e-6)
+        index.add(0, 1.0, 2.0)
+        index.add(1, 5.0, 5.0)
+        # Just across a grid cell boundary from item 0.
+        index.add(2, 1.0 + 1e-10, 2.0 - 1e-10)
+        index.add(3, 1.0, 2.1)
+        index.add(4, 5.0, 5.0)
+        self.assertEqual([2], index.coaxial(0))
+        self.assertEqual([], index.coaxial(3))
+        self.assertEqual([[0, 2], [1, 4]], index.groups())
+
+class TestTopology(unittest.TestCase):
+
+    def test_adjacency_is_consistent(self):
+        shape = Part.Shape()
+        shape.read('step_files/counter_bore.STEP')
+        topology = Topology(shape)
+        for i, face in enumerate(topology.faces):
+            self.assertEqual(i, topology.face_id(face))
+            edges = topology.edges_of_face(i)
+            self.assertEqual(
+                sorted({topology.edge_id(e) for e in face.Edges}),
+                list(edges))
+            for e in edges:
+                self.assertIn(i, topology.faces_of_edge(e))
+            for j in topology.adjacent_faces(i):
+                self.assertNotEqual(i, j)
+                self.assertIn(i, topology.adjacent_faces(j))
+
+
+class TestFaceInfo(unittest.TestCase):
+
+    def test_matches_face(self):
+        shape = Part.Shape()
+        shape.read('step_files/counter_bore.STEP')
+        kinds = set()
+        for face in shape.Faces:
+            info = FaceInfo(face)
+            kinds.add(info.kind)
+            self.assertEqual(info.zmin, face.BoundBox.ZMin)
+            self.assertEqual(info.zmax, face.BoundBox.ZMax)
+            self.assertEqual(info.parameter_range, face.ParameterRange)
+            if info.kind == 'cylinder':
+                self.assertEqual(info.radius, face.Surface.Radius)
+                self.assertEqual(info.concave, is_concave(face))
+        self.assertIn('cylinder', kinds)
+
+    def test_no_instance_dict(self):
+        shape = Part.Shape()
+        shape.read('step_files/counter_bore.STEP')
+        with self.assertRaises(AttributeError):
+            FaceInfo(shape.Faces[0]).other = 1
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_grid_levels_cover_grid_once(self):
+        levels = grid_levels(20)
+        points = [tuple(p) for level in levels for p in level]
+        self.assertEqual(400, len(points))
+        self.assertEqual(400, len(set(points)))
+        self.assertLess(len(levels[0]), 10)
+
+    def test_bspline_normals_match_occ(self):
+        shape = Part.Shape()
+        shape.read('step_files/manufacturable_splines.step')
+        splines = [f for f in shape.Faces
+                   if isinstance(f.Surface, Part.BSplineSurface)]
+        self.assertGreater(len(splines), 0)
+        for face in splines:
+            sampler = NormalSampler(face)
+            u1, u2, v1, v2 = face.ParameterRange
+            us = [u1 + (u2 - u1) * k / 7 for k in range(7)]
+            vs = [v1 + (v2 - v1) * (6 - k) / 7 for k in range(7)]
+            expected = [sampler.normal_z(u, v) for u, v in zip(us, vs)]
+            for a, b in zip(expected, sampler._evaluate(us, vs)):
+                self.assertAlmostEqual(a, b, places=9)
+
+    def test_extrusion_normals_match_occ(self):
+        for path in ('step_files/manufacturable_extrusion.step',
+                     'step_files/unmanufacturable_extrusion.step'):
+            shape = Part.Shape()
+            shape.read(path)
+            extrusions = [f for f in shape.Faces
+                          if isinstance(f.Surface, Part.SurfaceOfExtrusion)]
+            self.assertGreater(len(extrusions), 0)
+            for face in extrusions:
+                sampler = NormalSampler(face)
+                u1, u2, v1, v2 = face.ParameterRange
+                us = [u1 + (u2 - u1) * k / 7 for k in range(7)]
+                vs = [v1 + (v2 - v1) * (6 - k) / 7 for k in range(7)]
+                expected = [sampler.normal_z(u, v) for u, v in zip(us, vs)]
+                for a, b in zip(expected, sampler._evaluate(us, vs)):
+                    self.assertAlmostEqual(a, b, places=9)
+
+    def test_vertical_normals(self):
+        shape = Part.Shape()
+        shape.read('step_files/manufacturable_splines.step')
+        for face in shape.Faces:
+            if isinstance(face.Surface, Part.BSplineSurface):
+                self.assertFalse(has_vertical_normals(face))
+        shape = Part.Shape()
+        shape.read('step_files/good_part.STEP')
+        top = max(shape.Faces, key=lambda f: f.BoundBox.ZMin)
+        self.assertTrue(has_vertical_normals(top))
+
+
+class TestProfile(unittest.TestCase):
+
+    def test_segments_distance(self):
+        square = np.array([[(0, 0), (1, 0)], [(1, 0), (1, 1)],
+                           [(1, 1), (0, 1)], [(0, 1), (0, 0)]], dtype=float)
+        line = np.array([[(1.5, -2), (3, 2)]], dtype=float)
+        dist, p1, p2 = segments_distance(square, line)
+        self.assertAlmostEqual(5 / np.hypot(1.5, 4), dist)
+        self.assertAlmostEqual(dist, np.hypot(*(p2 - p1)))
+        self.assertEqual((1, 0), tuple(p1))
+
+    def test_matches_3d(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = [path for name, path in
+                 benchmark.synthetic_cases(directory, [2, 3])]
+        paths.append('step_files/thin_cut_between_radii.step')
+        extract_profile = solution.extract_profile
+        for path in paths:
+            fast = dfm_check(path, instrument=True)
+            solution.extract_profile = lambda a, deflection: None
+            try:
+                slow = dfm_check(path)
+            finally:
+                solution.extract_profile = extract_profile
+            self.assertEqual(slow['issues'], fast['issues'])
+            self.assertGreater(
+                fast['metrics']['counters']['pairs_settled_in_2d'], 0)
+
+
+class TestPrescan(unittest.TestCase):
+
+    def test_statements_split_across_chunks(self):
+        text = (u"HEADER;FILE_NAME('a;b /* c */','it''s;');ENDSEC;DATA;\n"
+                u"/* #9=SPHERICAL_SURFACE('',#4,1.); **/\n"
+                u"#1=ADVANCED_FACE('',(#2),#3,.T.);\n"
+                u"#3=SPHERICAL_SURFACE('x;y',#4,2.);\n"
+                u"#4=CARTESIAN_POINT('',(1.,-2.E+01,3.));\n"
+                u"#5=( LENGTH_UNIT ( ) NAMED_UNIT ( * ) "
+                u"SI_UNIT ( .MILLI., .METRE. ) );\nENDSEC;")
+        for chunk_size in range(1, 20):
+            result = prescan.scan_text(io.StringIO(text), chunk_size)
+            self.assertEqual(1, result.types['SPHERICAL_SURFACE'])
+            self.assertEqual(1, result.faces)
+            self.assertTrue(result.non_uniform)
+            self.assertEqual({'length': 'MILLIMETRE'}, result.units)
+            self.assertEqual((1, -20, 3, 1, -20, 3), result.extents)
+
+    def test_step_files(self):
+        for path in glob.glob('step_files/*'):
+            shape = Part.Shape()
+            shape.read(path)
+            result = prescan.scan(path)
+            self.assertEqual(len(shape.Faces), result.faces)
+            self.assertFalse(result.non_uniform)
+            self.assertIn('length', result.units)
+
+    def test_sphere_rejected_before_loading(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'dimple.step')
+        plate = Part.makeBox(20, 20, 3)
+        plate.cut(Part.makeSphere(2, FreeCAD.Vector(10, 10, 3))).exportStep(
+            path)
+        self.assertTrue(prescan.scan(path).non_uniform)
+        result = dfm_check(path, instrument=True)
+        self.assertEqual({'non-uniform': 1}, summarize(result))
+        self.assertEqual(1, result['metrics']['counters']['prescan_rejected'])
+        self.assertEqual({'non-uniform': 1},
+                         summarize(dfm_check(path, axes=True)))
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_revision_matches_full_run(self):
+        original = os.path.join(self.directory, 'a.step')
+        revised = os.path.join(self.directory, 'b.step')
+        benchmark.make_slot_array(original, 4)
+        benchmark.make_slot_array(revised, 4, width=2.5)
+        state = IncrementalState(solution.DETECTOR_VERSION)
+        splines = 'step_files/manufacturable_splines.step'
+        for path in (original, revised, splines):
+            self.assertEqual(dfm_check(path), dfm_check(path, state=state))
+        misses = state.misses
+        result = dfm_check(original, state=state, instrument=True)
+        self.assertEqual(misses, state.misses)
+        self.assertNotIn('incremental_misses', result['metrics']['counters'])
+        self.assertNotIn('distToShape_calls', result['metrics']['counters'])
+
+    def test_save_and_load(self):
+        path = os.path.join(self.directory, 'state.json')
+        state = IncrementalState('1')
+        state.put('a', True)
+        state.put('b', False)
+        state.save(path)
+        loaded = IncrementalState.load(path, '1')
+        self.assertEqual(True, loaded.get('a'))
+        self.assertEqual(False, loaded.get('b'))
+        self.assertIsNone(loaded.get('c'))
+        loaded.forget_unused()
+        self.assertEqual({'a': True, 'b': False}, loaded.entries)
+        self.assertEqual({}, IncrementalState.load(path, '2').entries)
+        self.assertEqual({}, IncrementalState.load(path + 'x', '1').entries)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = {'results': [{'name': 'a', 'seconds': 1.0},
+                                {'name': 'b', 'seconds': 1.0}]}
+        current = {'results': [{'name': 'a', 'seconds': 1.1},
+                               {'name': 'b', 'seconds': 2.0},
+                               {'name': 'c', 'seconds': 5.0}]}
+        self.assertEqual([('b', 1.0, 2.0)],
+                         benchmark.compare(baseline, current, 1.25))
+
+    def test_time_case(self):
+        path = 'step_files/counter_bore.STEP'
+        shape = Part.Shape()
+        shape.read(path)
+        result = benchmark._time_case(('counter_bore', path, 1))
+        self.assertEqual(len(shape.Faces), result['faces'])
+        self.assertGreaterEqual(result['rss_growth_kb'], 0)
+
+    def test_synthetic_parts(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name, path in benchmark.synthetic_cases(directory, [2]):
+            result = dfm_check(path)
+            if name.startswith('slots'):
+                self.assertIn('small-cut', summarize(result))
+            else:
+                self.assertEqual({'issues': []}, result)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_cached_result_matches(self):
+        cache = ResultCache(self.directory)
+        path = 'step_files/small_hole.STEP'
+        expected = dfm_check(path)
+        self.assertEqual(expected, dfm_check(path, cache=cache))
+        self.assertEqual(expected, dfm_check(path, cache=cache))
+        stats = cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+
+    def test_key_depends_on_kerf_and_version(self):
+        keys = {ResultCache.key('abc', None, '1'),
+                ResultCache.key('abc', 3.175, '1'),
+                ResultCache.key('abc', None, '2'),
+                ResultCache.key('abc', None, '1', ['axes'])}
+        self.assertEqual(4, len(keys))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(self.directory, max_entries=2)
+        for key in ('a', 'b'):
+            cache.put(key, {'issues': []})
+        # Make 'b' the least recently used entry before adding another.
+        os.utime(os.path.join(self.directory, 'b.json'), (0, 0))
+        cache.put('c', {'issues': []})
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.evictions)
+
+    def test_running_totals(self):
+        cache = ResultCache(self.directory, max_entries=2)
+        for key in ('a', 'a', 'b'):
+            cache.put(key, {'issues': []})
+        self.assertEqual(0, cache.evictions)
+        # Entries written elsewhere are only noticed on the next rescan,
+        # which happens once this object's own totals go over the limit.
+        ResultCache(self.directory).put('c', {'issues': []})
+        self.assertEqual(3, cache.stats()['entries'])
+        cache.put('d', {'issues': []})
+        self.assertEqual(2, cache.stats()['entries'])
+        self.assertEqual(2, cache.evictions)
+
+    def test_expired_entries_miss(self):
+        cache = ResultCache(self.directory, max_age=60)
+        cache.put('a', {'issues': []})
+        os.utime(os.path.join(self.directory, 'a.json'), (0, 0))
+        self.assertIsNone(cache.get('a'))
+
+
+class TestGeometryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_reload_matches(self):
+        cache = GeometryCache(self.directory)
+        for path in ('step_files/counter_sinks.STEP',
+                     'step_files/thin_cut_between_radii.step'):
+            for kerf_width in (None, 1.0, None):
+                result = dfm_check(path, kerf_width, geometry=cache,
+                                   instrument=True)
+                self.assertEqual(dfm_check(path, kerf_width)['issues'],
+                                 result['issues'])
+        self.assertEqual(2, cache.misses)
+        self.assertEqual(4, cache.hits)
+        self.assertEqual(2, cache.stats()['entries'])
+
+    def test_topology_matches(self):
+        cache = GeometryCache(self.directory, max_entries=1)
+        shape = Part.Shape()
+        shape.read('step_files/counter_bore.STEP')
+        topology = Topology(shape)
+        cache.put('a', shape, topology)
+        loaded, face_edges = cache.get('a')
+        reloaded = Topology(loaded, face_edges)
+        for i in range(len(topology.faces)):
+            self.assertEqual(topology.adjacent_faces(i),
+                             reloaded.adjacent_faces(i))
+        self.assertEqual(Topology(loaded).faces_of_edge(0),
+                         reloaded.faces_of_edge(0))
+        cache.put('b', shape, topology)
+        self.assertIsNone(cache.get('a'))
+
+    def test_broken_entries_miss(self):
+        cache = GeometryCache(self.directory)
+        path = 'step_files/counter_bore.STEP'
+        key = cache.key(solution.file_digest(path))
+        for content in (b'{"faces": 1}\nnot brep', b'{}\n',
+                        b'[1, 2]\n', b'not json'):
+            with open(cache._path(key), 'wb') as f:
+                f.write(content)
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(dfm_check(path),
+                             dfm_check(path, geometry=cache))
+            self.assertIsNotNone(cache.get(key))
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_check_many(self):
+        paths = ['step_files/good_part.STEP', 'step_files/missing.STEP',
+                 'step_files/draft.STEP']
+        results = {p: (r, e) for p, r, e in check_many(paths, processes=2)}
+        self.assertEqual(set(paths), set(results))
+        self.assertEqual(({'issues': []}, None), results[paths[0]])
+        self.assertIsNone(results[paths[1]][0])
+        self.assertIsNotNone(results[paths[1]][1])
+        self.assertEqual(dfm_check(paths[2]), results[paths[2]][0])
+
+    def test_timeout(self):
+        paths = ['step_files/good_part.STEP', 'step_files/draft.STEP']
+        results = list(check_many(paths, processes=1, timeout=1e-3))
+        self.assertEqual(set(paths), set(p for p, r, e in results))
+        for step_path, result, error in results:
+            self.assertIsNone(result)
+            self.assertIn('Timed out', error)
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CheckServer(('127.0.0.1', 0), workers=1)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def post(self, body):
+        connection = HTTPConnection(*self.server.server_address)
+        connection.request('POST', '/check', json.dumps(body))
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+
+    def test_check(self):
+        path = 'step_files/small_hole.STEP'
+        status, body = self.post({'path': path})
+        self.assertEqual(200, status)
+        self.assertEqual(dfm_check(path), body['result'])
+        status, body = self.post({'path': path, 'kerf_width': 0.01})
+        self.assertEqual(200, status)
+        self.assertEqual(dfm_check(path, kerf_width=0.01), body['result'])
+
+    def test_errors(self):
+        status, body = self.post({'path': 'step_files/missing.STEP'})
+        self.assertEqual(500, status)
+        status, body = self.post({'kerf_width': 1})
+        self.assertEqual(400, status)
+
+    def test_timeout(self):
+        self.server.job_timeout = 1e-3
+        status, body = self.post({'path': 'step_files/small_hole.STEP'})
+        self.assertEqual(500, status)
+        self.assertIn('Timed out', body['error'])
+        self.server.job_timeout = None
+        status, body = self.post({'path': 'step_files/small_hole.STEP'})
+        self.assertEqual(200, status)
+
+
 if __name__ == '__main__':
     unittest.main()
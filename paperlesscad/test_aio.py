@@ -0,0 +1,59 @@
+"""Tests for paperlesscad.aio, which only run on Python 3.7 or later.
+
+They are run along with the rest from paperlesscad.test.
+
+"""
+
+import asyncio
+import unittest
+
+from paperlesscad.aio import AsyncChecker
+from paperlesscad.solution import CHECKS, dfm_check
+
+
+class TestAsyncChecker(unittest.TestCase):
+
+    def test_check(self):
+        path = 'step_files/small_hole.STEP'
+        names = []
+
+        async def run():
+            async with AsyncChecker(workers=1) as checker:
+                return await checker.check(path, progress=names.append)
+
+        self.assertEqual((dfm_check(path), None), asyncio.run(run()))
+        self.assertTrue(names)
+        self.assertTrue(set(names) <= {c.name for c in CHECKS})
+
+    def test_error(self):
+        async def run():
+            async with AsyncChecker(workers=1) as checker:
+                return await checker.check('step_files/missing.STEP')
+
+        result, error = asyncio.run(run())
+        self.assertIsNone(result)
+        self.assertIsNotNone(error)
+
+    def test_queue_full(self):
+        async def run():
+            async with AsyncChecker(workers=1, max_queued=0) as checker:
+                first = asyncio.ensure_future(
+                    checker.check('step_files/good_part.STEP'))
+                await asyncio.sleep(0)
+                with self.assertRaises(asyncio.QueueFull):
+                    await checker.check('step_files/good_part.STEP')
+                await first
+                return checker.stats
+
+        self.assertEqual(1, asyncio.run(run())['rejected'])
+
+    def test_timeout_replaces_worker(self):
+        path = 'step_files/good_part.STEP'
+
+        async def run():
+            async with AsyncChecker(workers=1) as checker:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await checker.check(path, timeout=1e-3)
+                return await checker.check(path)
+
+        self.assertEqual(({'issues': []}, None), asyncio.run(run()))
@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import
 
+from array import array
+
 import FreeCAD
 import Part
 
@@ -11,6 +13,12 @@ def is_close(a, b, tol=1e-13):
     return abs(a - b) < tol
 
 
+def is_vertical(vector):
+    "Check if a unit vector points straight up or down."
+    return (is_close(vector.x, 0) and is_close(vector.y, 0)
+            and is_close(abs(vector.z), 1))
+
+
 class HashShape(object):
     """Decorator for Part.Shape, that can be used as key in dicts. Based on isSame method.
     
@@ -42,3 +50,183 @@ def is_concave(face):
     # Check that the vector from center to point on surface is opposite to the
     # normal vector at that point.
     return (loc - center).dot(norm) < 0
+
+
+# Kinds of surface told apart by FaceInfo.kind, and their FreeCAD types.
+_SURFACE_KINDS = (('plane', Part.Plane), ('cylinder', Part.Cylinder),
+                  ('cone', Part.Cone), ('sphere', Part.Sphere),
+                  ('torus', Part.Toroid))
+
+
+class FaceInfo(object):
+    """Properties of a face that the checks use, read from FreeCAD once.
+
+    Every FreeCAD property read makes new wrapper objects, and some need a
+    round trip into OCC, so each one is only read the first time that it is
+    asked for and then kept.  kind is one of 'plane', 'cylinder', 'cone',
+    'sphere', 'torus' or 'other'.  axis, center and radius are those of the
+    surface, for the kinds of surface that have them.  The vectors are shared,
+    so must not be changed in place.
+
+    """
+    __slots__ = ('face', '_surface', '_kind', '_axis', '_center', '_radius',
+                 '_bound_box', '_parameter_range', '_concave')
+
+    def __init__(self, face):
+        self.face = face
+        self._surface = None
+        self._kind = None
+        self._axis = None
+        self._center = None
+        self._radius = None
+        self._bound_box = None
+        self._parameter_range = None
+        self._concave = None
+
+    @property
+    def surface(self):
+        if self._surface is None:
+            self._surface = self.face.Surface
+        return self._surface
+
+    @property
+    def kind(self):
+        if self._kind is None:
+            self._kind = 'other'
+            for kind, surface_type in _SURFACE_KINDS:
+                if isinstance(self.surface, surface_type):
+                    self._kind = kind
+                    break
+        return self._kind
+
+    @property
+    def axis(self):
+        if self._axis is None:
+            self._axis = self.surface.Axis
+        return self._axis
+
+    @property
+    def center(self):
+        if self._center is None:
+            self._center = self.surface.Center
+        return self._center
+
+    @property
+    def radius(self):
+        if self._radius is None:
+            self._radius = self.surface.Radius
+        return self._radius
+
+    @property
+    def bound_box(self):
+        if self._bound_box is None:
+            self._bound_box = self.face.BoundBox
+        return self._bound_box
+
+    @property
+    def zmin(self):
+        return self.bound_box.ZMin
+
+    @property
+    def zmax(self):
+        return self.bound_box.ZMax
+
+    @property
+    def parameter_range(self):
+        if self._parameter_range is None:
+            self._parameter_range = self.face.ParameterRange
+        return self._parameter_range
+
+    @property
+    def concave(self):
+        "Whether a cylindrical or conical face is concave, as with is_concave."
+        if self._concave is None:
+            self._concave = is_concave(self.face)
+        return self._concave
+
+
+def _compress(rows):
+    """Pack a list of lists of integers into compressed sparse row arrays.
+
+    Returns (start, values), where row i is values[start[i]:start[i + 1]].
+
+    """
+    start = array('l', [0])
+    values = array('l')
+    for row in rows:
+        values.extend(row)
+        start.append(len(values))
+    return start, values
+
+
+class Topology(object):
+    """Face and edge connectivity of a shape, using integer indices.
+
+    Faces and edges are numbered by their position in shape.Faces and
+    shape.Edges.  The connectivity is found once, and then stored in compressed
+    sparse row arrays so that looking up the neighbours of a face or edge is
+    just a slice.  Converting a face or edge back into its index is a single
+    dict lookup.
+
+    face_edges can be given as a list of the edge indices of each face, as
+    found before for the same shape, to save finding them again.
+
+    """
+
+    def __init__(self, shape, face_edges=None):
+        self.faces = shape.Faces
+        self.edges = shape.Edges
+        self.face_ids = {HashShape(f): i for i, f in enumerate(self.faces)}
+        self.edge_ids = {HashShape(e): i for i, e in enumerate(self.edges)}
+
+        # Edges of each face.  The same edge can appear twice on one face (e.g.
+        # the seam of a full cylinder), so remove repeats.
+        if face_edges is None:
+            face_edges = [
+                sorted({self.edge_ids[HashShape(e)] for e in f.Edges})
+                for f in self.faces]
+
+        # Faces of each edge.  There is usually two faces per edge, but
+        # sometimes only one.  I don't think that more than two is possible,
+        # but let's not assume.
+        # NOTE FreeCAD 0.17 will have an "ancestorsOfType" method that could
+        # simplify or replace this code.  See FreeCAD commit f9bfd775.
+        edge_faces = [[] for _ in self.edges]
+        for i, es in enumerate(face_edges):
+            for e in es:
+                edge_faces[e].append(i)
+
+        # Faces adjacent to each face (i.e. all faces that share an edge with
+        # this face), not counting the face itself.
+        face_faces = [
+            sorted({f for e in es for f in edge_faces[e]} - {i})
+            for i, es in enumerate(face_edges)]
+
+        self._face_edges = _compress(face_edges)
+        self._edge_faces = _compress(edge_faces)
+        self._face_faces = _compress(face_faces)
+
+    @staticmethod
+    def _row(packed, i):
+        start, values = packed
+        return values[start[i]:start[i + 1]]
+
+    def face_id(self, face):
+        "Index of a face within shape.Faces."
+        return self.face_ids[HashShape(face)]
+
+    def edge_id(self, edge):
+        "Index of an edge within shape.Edges."
+        return self.edge_ids[HashShape(edge)]
+
+    def edges_of_face(self, i):
+        "Indices of the edges bounding face i."
+        return self._row(self._face_edges, i)
+
+    def faces_of_edge(self, i):
+        "Indices of the faces attached to edge i."
+        return self._row(self._edge_faces, i)
+
+    def adjacent_faces(self, i):
+        "Indices of the faces sharing an edge with face i."
+        return self._row(self._face_faces, i)
@@ -0,0 +1,109 @@
+"""Worker processes that check STEP files one at a time, and can be killed.
+
+Unlike those of multiprocessing.Pool, each worker is a process of its own
+with its own pipe.  A worker that crashes on a file, or takes too long over
+it, can then be found out and replaced without losing any other work.
+
+"""
+
+from __future__ import absolute_import, division
+
+import multiprocessing
+import time
+import traceback
+
+
+def serve(conn, cache=None):
+    """Main loop of a worker process.
+
+    Receives (step_path, options) jobs from conn, passing options on to
+    dfm_check.  Sends ('progress', name) as each check finishes, then either
+    ('result', result) or ('error', traceback).  Stops when sent None.
+
+    """
+    # Load FreeCAD once when the worker starts, instead of for each file.
+    from paperlesscad.solution import dfm_check
+
+    def progress(name):
+        conn.send(('progress', name))
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        step_path, options = job
+        try:
+            result = dfm_check(step_path, cache=cache, progress=progress,
+                               **options)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+        else:
+            conn.send(('result', result))
+
+
+class Worker(object):
+    """A process running serve, checking one file at a time for its owner.
+
+    jobs counts the files it has been given.  Once a check has timed out or
+    the process has exited, alive is False and a new Worker is needed.
+
+    """
+
+    def __init__(self, cache=None, context=multiprocessing):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn, cache))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.alive = True
+
+    def check(self, step_path, timeout=None, progress=None, **options):
+        """Check a file, returning (result, error) as for batch.check_many.
+
+        Other keyword options are passed on to dfm_check.  progress, if
+        given, is called with the name of each check as it finishes.  If the
+        check takes longer than timeout seconds, or the process exits part
+        way through, the process is killed and error says which happened.
+
+        """
+        self.jobs += 1
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            self.conn.send((step_path, options))
+            while True:
+                wait = None
+                if deadline is not None:
+                    wait = max(0.0, deadline - time.time())
+                if not self.conn.poll(wait):
+                    self.kill()
+                    return None, 'Timed out after {}s checking {}'.format(
+                        timeout, step_path)
+                kind, value = self.conn.recv()
+                if kind == 'progress':
+                    if progress is not None:
+                        progress(value)
+                elif kind == 'result':
+                    return value, None
+                else:
+                    return None, value
+        except (EOFError, IOError, OSError):
+            self.kill()
+            return None, 'Worker process exited while checking {}'.format(
+                step_path)
+
+    def stop(self):
+        "Ask the process to exit once it has finished its current job."
+        try:
+            self.conn.send(None)
+            self.conn.close()
+        except (IOError, OSError, ValueError):
+            pass
+        self.alive = False
+
+    def kill(self):
+        "End the process straight away, and wait for it to go."
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+        self.alive = False